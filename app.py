@@ -1,15 +1,52 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context
+from flask import before_render_template, send_from_directory, template_rendered
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, insert, update, delete, select, and_, bindparam, event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import groupby
+import bcrypt
+import click
+import cProfile
+import csv
+import hashlib
+import io
 import json
+import multiprocessing
+import os
+import pstats
+import queue
+import random
+import re
+import secrets
+import sqlite3
+import struct
+import threading
+import time
 import numpy as np
+import pandas as pd
 from config import Config
 
 app = Flask(__name__)
 app.config.from_object(Config)
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """WAL позволяет читать во время записи, busy_timeout - ждать блокировку, а не падать."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+        cursor.close()
+
 # Модели базы данных
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -23,6 +60,10 @@ class User(db.Model):
     profile_visibility = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     test_results = db.relationship('TestResult', backref='user', lazy=True)
+    __table_args__ = (
+        db.Index('ix_user_role', 'role'),
+        db.Index('ix_user_faculty_course', 'faculty', 'course'),
+    )
 
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -32,10 +73,13 @@ class Question(db.Model):
     active = db.Column(db.Boolean, default=True)
     order_num = db.Column(db.Integer)
     options = db.relationship('QuestionOption', backref='question', lazy=True, cascade='all, delete-orphan')
+    __table_args__ = (
+        db.Index('ix_question_active_order', 'active', 'order_num'),
+    )
 
 class QuestionOption(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False, index=True)
     text = db.Column(db.Text, nullable=False)
     score = db.Column(db.Integer, nullable=False)
     order_num = db.Column(db.Integer)
@@ -44,10 +88,81 @@ class TestResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     test_date = db.Column(db.DateTime, default=datetime.utcnow)
-    answers = db.Column(db.Text)  # JSON строка с ответами
+    answers = db.Column(db.Text)  # JSON строка с ответами (старые результаты)
+    answers_packed = db.Column(db.LargeBinary)  # pack_answers(): ответы новых и перенесённых результатов
     scores = db.Column(db.Text)  # JSON строка с баллами по компетенциям
-    recommendations = db.Column(db.Text)
+    recommendations = db.Column(db.Text)  # JSON строка с рекомендациями (старые результаты)
+    # RecommendationPayload.hash: рекомендации новых и перенесённых результатов
+    recommendation_hash = db.Column(db.String(64), db.ForeignKey('recommendation_payload.hash'))
     profile_data = db.Column(db.Text)  # JSON данные для визуализации
+    # SCORES_SCHEMA_VERSION; NULL - баллы могут содержать старые ключи компетенций
+    scores_version = db.Column(db.Integer, index=True)
+    __table_args__ = (
+        db.Index('ix_test_result_user_date', 'user_id', 'test_date'),
+        db.Index('ix_test_result_test_date', 'test_date'),
+    )
+
+class RecommendationPayload(db.Model):
+    """Рекомендации, общие для всех результатов с одинаковым содержимым; ключ - SHA-256 их JSON"""
+    hash = db.Column(db.String(64), primary_key=True)
+    payload = db.Column(db.Text, nullable=False)
+
+class RecommendationRule(db.Model):
+    """Правка правил рекомендаций для компетенции; NULL в поле - значение по умолчанию"""
+    competency = db.Column(db.String(50), primary_key=True)
+    career_fields = db.Column(db.Text)  # JSON список профессиональных сфер
+    courses = db.Column(db.Text)  # JSON список курсов
+    activities = db.Column(db.Text)  # JSON список активностей
+
+class AppCounter(db.Model):
+    """Монотонно растущие счётчики версий (например, версия банка вопросов)"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class CompetencyScore(db.Model):
+    """Баллы результата по компетенциям в нормализованном виде, для аналитики средствами SQL"""
+    id = db.Column(db.Integer, primary_key=True)
+    result_id = db.Column(db.Integer, db.ForeignKey('test_result.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    competency = db.Column(db.String(50), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    test_date = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_competency_score_competency_score', 'competency', 'score'),
+        db.Index('ix_competency_score_user_date', 'user_id', 'test_date'),
+    )
+
+class CompetencyAggregate(db.Model):
+    """Накопительная статистика по компетенции, обновляется при каждом сохранении результата"""
+    competency = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=False, default=0.0)
+    m2 = db.Column(db.Float, nullable=False, default=0.0)  # сумма квадратов отклонений (Уэлфорд)
+    min_score = db.Column(db.Float)
+    max_score = db.Column(db.Float)
+    histogram = db.Column(db.Text)  # JSON {номер интервала: количество}, интервал HISTOGRAM_BIN_WIDTH
+
+class CohortHistogram(db.Model):
+    """Распределение баллов когорты по интервалам HISTOGRAM_BIN_WIDTH, для перцентильных рангов"""
+    cohort = db.Column(db.String(200), primary_key=True)  # ключ из cohort_keys()
+    competency = db.Column(db.String(50), primary_key=True)
+    bin = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class StudentTrend(db.Model):
+    """Сводка динамики студента по попыткам, обновляется при каждом сохранении результата"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    latest_result_id = db.Column(db.Integer, db.ForeignKey('test_result.id'))
+    latest_date = db.Column(db.DateTime)
+    summary = db.Column(db.Text)  # JSON: first, latest, best, rolling_average, delta, recent
+
+class ResultDelta(db.Model):
+    """Изменение баллов результата относительно предыдущей попытки того же студента"""
+    result_id = db.Column(db.Integer, db.ForeignKey('test_result.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    previous_result_id = db.Column(db.Integer, db.ForeignKey('test_result.id'), nullable=False)
+    deltas = db.Column(db.Text, nullable=False)  # JSON {компетенция: изменение балла}
 
 # Модель надпрофессиональных компетенций
 # Объединены компетенции: problem_solving + digital_literacy -> critical_thinking
@@ -119,6 +234,121 @@ def merge_scores_to_current_model(raw_scores: dict) -> dict:
             normalized[key] = 0
     return normalized
 
+# Версия формата баллов TestResult: ровно ключи COMPETENCIES, без алиасов
+SCORES_SCHEMA_VERSION = 1
+
+def normalize_scores(scores: dict) -> dict:
+    """Баллы в текущей модели компетенций; слияние алиасов - только если ключи не совпадают с COMPETENCIES."""
+    if scores.keys() == COMPETENCIES.keys():
+        return scores
+    return merge_scores_to_current_model(scores)
+
+def read_result_scores(scores_json, scores_version):
+    """Баллы сохранённого результата: приведённые строки читаются без слияния алиасов."""
+    scores = json.loads(scores_json)
+    if scores_version == SCORES_SCHEMA_VERSION:
+        return scores
+    return merge_scores_to_current_model(scores)
+
+QUESTION_BANK_COUNTER = 'question_bank'
+# Меняется при каждом сохранении или пересчёте результатов
+RESULTS_COUNTER = 'results'
+
+def get_counter(name):
+    return db.session.query(AppCounter.value).filter_by(name=name).scalar() or 0
+
+def bump_counter(name):
+    """Увеличивает счётчик в текущей транзакции и возвращает новое значение."""
+    value = db.session.execute(
+        update(AppCounter).where(AppCounter.name == name).values(value=AppCounter.value + 1).returning(AppCounter.value)
+    ).scalar()
+    if value is None:
+        value = 1
+        db.session.add(AppCounter(name=name, value=value))
+    return value
+
+def get_question_bank_version():
+    return get_counter(QUESTION_BANK_COUNTER)
+
+# Максимальный балл за вопрос (шкала 1-4)
+MAX_OPTION_SCORE = 4
+
+ScoringEntry = namedtuple('ScoringEntry', ['question_id', 'competency', 'score', 'max_score'])
+
+class ScoringIndex:
+    """
+    Индекс банка вопросов для подсчёта баллов без обращений к БД.
+    Отображает option_id -> (question_id, актуальная компетенция, балл, максимальный балл).
+    Строится один раз на процесс и обновляется при изменении банка вопросов;
+    version - версия банка, по которой построен индекс (None - неизвестна).
+    """
+
+    def __init__(self):
+        self._entries = None
+        self._lock = threading.Lock()
+        self.version = None
+
+    @staticmethod
+    def _entries_for_question(question_id, competency, options):
+        resolved_key = resolve_competency_key(competency)
+        return {
+            option.id: ScoringEntry(question_id, resolved_key, option.score, MAX_OPTION_SCORE)
+            for option in options
+        }
+
+    def rebuild(self, version=None):
+        """Полное перестроение индекса по таблицам Question/QuestionOption."""
+        rows = db.session.query(
+            QuestionOption.id, QuestionOption.score, Question.id, Question.competency
+        ).join(Question, QuestionOption.question_id == Question.id).all()
+        entries = {
+            option_id: ScoringEntry(question_id, resolve_competency_key(competency), score, MAX_OPTION_SCORE)
+            for option_id, score, question_id, competency in rows
+        }
+        with self._lock:
+            self._entries = entries
+            self.version = version
+
+    def sync(self, version):
+        """Перестраивает индекс, если банк изменён (в том числе другим процессом)."""
+        if self._entries is None or self.version != version:
+            self.rebuild(version)
+
+    def entries(self):
+        if self._entries is None:
+            self.rebuild()
+        return self._entries
+
+    def _patch(self, question_id, fresh, version):
+        with self._lock:
+            if self._entries is None:
+                return
+            if self.version is not None and version != self.version + 1:
+                # Пропущены изменения из других процессов - индекс перестроится при следующем обращении
+                self._entries = None
+                return
+            entries = {k: v for k, v in self._entries.items() if v.question_id != question_id}
+            entries.update(fresh)
+            self._entries = entries
+            self.version = version
+
+    def update_question(self, question, version):
+        """Заменяет в индексе варианты ответа одного вопроса (copy-on-write)."""
+        fresh = self._entries_for_question(question.id, question.competency, question.options)
+        self._patch(question.id, fresh, version)
+
+    def remove_question(self, question_id, version):
+        self._patch(question_id, {}, version)
+
+    def lookup(self, question_id, option_id):
+        """Возвращает запись индекса; ValueError, если вариант не относится к вопросу."""
+        entry = self.entries().get(option_id)
+        if entry is None or entry.question_id != question_id:
+            raise ValueError(f'Вариант ответа {option_id} не относится к вопросу {question_id}')
+        return entry
+
+scoring_index = ScoringIndex()
+
 def calculate_competency_profile(answers):
     """
     Алгоритм построения личностной карты компетенций
@@ -128,20 +358,19 @@ def calculate_competency_profile(answers):
     - Нормализация результатов к шкале 0-100%
     - Максимальный балл за вопрос: 4 (шкала 1-4)
     - Для каждой компетенции: (сумма_баллов / (количество_вопросов * 4)) * 100
+    
+    Баллы берутся из scoring_index, обращений к БД нет.
+    ValueError, если вариант ответа не принадлежит указанному вопросу.
     """
     scores = {comp: 0 for comp in COMPETENCIES.keys()}
     max_scores = {comp: 0 for comp in COMPETENCIES.keys()}
     
     # Подсчёт баллов по каждой компетенции
     for answer in answers:
-        question = Question.query.get(answer['question_id'])
-        if question:
-            resolved_key = resolve_competency_key(question.competency)
-            if resolved_key in COMPETENCIES:
-                option = QuestionOption.query.get(answer['option_id'])
-                if option:
-                    scores[resolved_key] += option.score
-                    max_scores[resolved_key] += 4  # Максимальный балл за вопрос (шкала 1-4)
+        entry = scoring_index.lookup(answer['question_id'], answer['option_id'])
+        if entry.competency in COMPETENCIES:
+            scores[entry.competency] += entry.score
+            max_scores[entry.competency] += entry.max_score
     
     # Нормализация (в процентах) - психометрический подход
     normalized_scores = {}
@@ -154,6 +383,163 @@ def calculate_competency_profile(answers):
     
     return normalized_scores
 
+# Рекомендации по развитию компетенций (объединены из влитых компетенций);
+# администратор может переопределить их для компетенции (RecommendationRule)
+DEVELOPMENT_MAP = {
+    'critical_thinking': {
+        'courses': ['Логика и аргументация', 'Анализ данных', 'Системное мышление', 'Алгоритмы', 'Системный анализ', 'Цифровые инструменты', 'Data Science', 'Дизайн-мышление', 'ТРИЗ'],
+        'activities': ['Решение кейсов', 'Участие в дискуссионных клубах', 'Чтение научной литературы', 'Олимпиады', 'Кейс-чемпионаты', 'Научные проекты', 'Онлайн-курсы', 'IT-проекты', 'Хакатоны', 'Творческие проекты']
+    },
+    'communication': {
+        'courses': ['Публичные выступления', 'Деловое общение', 'Переговоры', 'Маркетинг и реклама'],
+        'activities': ['Дебаты', 'Волонтёрство', 'Студенческие конференции', 'Творческие проекты']
+    },
+    'emotional_intelligence': {
+        'courses': ['Психология общения', 'Управление конфликтами', 'Эмпатия', 'Майндфулнесс', 'Стресс-менеджмент', 'Самоорганизация', 'Управление изменениями', 'Agile'],
+        'activities': ['Тренинги по EQ', 'Групповая терапия', 'Менторство', 'Медитация', 'Спорт', 'Йога', 'Дыхательные практики', 'Работа в стартапах', 'Новые хобби']
+    },
+    'time_management': {
+        'courses': ['Тайм-менеджмент', 'GTD', 'Продуктивность', 'Управление изменениями', 'Agile'],
+        'activities': ['Планирование дня', 'Pomodoro техника', 'Ведение дневника', 'Путешествия', 'Новые хобби']
+    },
+    'teamwork': {
+        'courses': ['Командная работа', 'Управление проектами', 'Фасилитация'],
+        'activities': ['Групповые проекты', 'Спортивные команды', 'Волонтёрство']
+    }
+}
+# Меняется при каждой правке правил рекомендаций администратором
+RECOMMENDATION_RULES_COUNTER = 'recommendation_rules'
+# Поля правил, которые может переопределить администратор
+RECOMMENDATION_RULE_FIELDS = ('career_fields', 'courses', 'activities')
+
+# Пороги методики: сильная сторона (среди топ-3), зона развития, персональные курсы и активности
+STRONG_SCORE = 70
+DEVELOPMENT_SCORE = 60
+TOP_COMPETENCIES = 3
+MAX_CAREER_PATHS = 8
+MAX_DEVELOPMENT_ITEMS = 6
+PER_COMPETENCY_ITEMS = 3
+
+CompiledRule = namedtuple('CompiledRule', ['name', 'description', 'career_fields', 'courses', 'activities'])
+# template - рекомендации без баллов (их хранит RecommendationPayload), hash и payload - из encode_recommendations
+RecommendationPlan = namedtuple('RecommendationPlan', ['template', 'hash', 'payload'])
+
+def score_band(score):
+    """Интервал балла по порогам методики: 0 - сильная сторона, 1 - средний уровень, 2 - зона развития."""
+    if score >= STRONG_SCORE:
+        return 0
+    return 1 if score >= DEVELOPMENT_SCORE else 2
+
+class RecommendationEngine:
+    """
+    Правила рекомендаций, скомпилированные из COMPETENCIES, DEVELOPMENT_MAP и правок
+    администратора (RecommendationRule). Состав рекомендаций зависит только от порядка
+    компетенций по баллу и интервалов score_band, поэтому план (какие компетенции, профессии,
+    курсы и активности войдут в ответ, вместе с его JSON и ключом содержимого) запоминается
+    по этой сигнатуре, а баллы подставляются при каждом вызове. Правила строятся один раз на процесс и перестраиваются при изменении
+    RECOMMENDATION_RULES_COUNTER; version - версия правил (None - неизвестна).
+    """
+
+    def __init__(self):
+        self._compiled = None  # (правила, планы) заменяются вместе
+        self._lock = threading.Lock()
+        self.version = None
+
+    @staticmethod
+    def compile_rules(overrides):
+        """Правила по компетенциям: значения по умолчанию с правками {компетенция: {поле: список}}."""
+        rules = {}
+        for comp, info in COMPETENCIES.items():
+            development = DEVELOPMENT_MAP.get(comp, {})
+            fields = {
+                'career_fields': info['career_fields'],
+                'courses': development.get('courses', []),
+                'activities': development.get('activities', [])
+            }
+            fields.update(overrides.get(comp, {}))
+            rules[comp] = CompiledRule(
+                info['name'],
+                info['description'],
+                tuple(dict.fromkeys(fields['career_fields'])),
+                tuple(fields['courses']),
+                tuple(fields['activities'])
+            )
+        return rules
+
+    @staticmethod
+    def load_overrides():
+        overrides = {}
+        for rule in RecommendationRule.query.all():
+            overrides[rule.competency] = {
+                field: json.loads(getattr(rule, field))
+                for field in RECOMMENDATION_RULE_FIELDS if getattr(rule, field) is not None
+            }
+        return overrides
+
+    def rebuild(self, version=None, overrides=None):
+        """Компиляция правил; без overrides правки читаются из БД. Запомненные планы сбрасываются."""
+        rules = self.compile_rules(self.load_overrides() if overrides is None else overrides)
+        with self._lock:
+            self._compiled = (rules, {})
+            self.version = version
+
+    def sync(self, version):
+        """Перестраивает правила, если их изменил администратор (в том числе в другом процессе)."""
+        if self._compiled is None or self.version != version:
+            self.rebuild(version)
+
+    def compiled(self):
+        if self._compiled is None:
+            self.rebuild()
+        return self._compiled
+
+    @staticmethod
+    def plan(rules, signature):
+        """План рекомендаций для сигнатуры ((компетенция, интервал), ...) по убыванию балла."""
+        top = signature[:TOP_COMPETENCIES]
+        career_paths = dict.fromkeys(field for comp, _ in top for field in rules[comp].career_fields)
+        developing = [comp for comp, band in signature if band > 0]
+        
+        def describe(comp):
+            return {'competency': comp, 'name': rules[comp].name, 'description': rules[comp].description}
+        
+        template = {
+            'strong_competencies': [describe(comp) for comp, band in top if band == 0],
+            'development_areas': [describe(comp) for comp, band in signature if band == 2],
+            'career_paths': list(career_paths)[:MAX_CAREER_PATHS],
+            'courses': list(dict.fromkeys(
+                c for comp in developing for c in rules[comp].courses[:PER_COMPETENCY_ITEMS]))[:MAX_DEVELOPMENT_ITEMS],
+            'activities': list(dict.fromkeys(
+                a for comp in developing for a in rules[comp].activities[:PER_COMPETENCY_ITEMS]))[:MAX_DEVELOPMENT_ITEMS]
+        }
+        return RecommendationPlan(template, *encode_recommendations(template))
+
+    def _plan_for(self, scores, memoize):
+        """План для баллов и баллы в текущей модели компетенций."""
+        rules, plans = self.compiled()
+        normalized_scores = normalize_scores(scores)
+        # Сортировка компетенций по уровню (только те, для которых есть вопросы)
+        ranked = sorted(((comp, score) for comp, score in normalized_scores.items() if score > 0),
+                        key=lambda item: item[1], reverse=True)
+        signature = tuple((comp, score_band(score)) for comp, score in ranked)
+        plan = plans.get(signature) if memoize else None
+        if plan is None:
+            plan = self.plan(rules, signature)
+            if memoize:
+                plans[signature] = plan
+        return plan, normalized_scores
+
+    def recommend(self, scores, memoize=True):
+        plan, normalized_scores = self._plan_for(scores, memoize)
+        return attach_recommendation_scores(plan.template, normalized_scores)
+
+    def encoded(self, scores):
+        """Ключ и JSON рекомендаций без баллов - то, что хранит RecommendationPayload."""
+        plan, _ = self._plan_for(scores, memoize=True)
+        return plan.hash, plan.payload
+
+recommendation_engine = RecommendationEngine()
+
 def generate_recommendations(scores):
     """
     Алгоритм формирования персонализированных рекомендаций
@@ -165,80 +551,7 @@ def generate_recommendations(scores):
     - Карьерные траектории: на основе топ-3 компетенций
     - Персонализированные курсы и активности для компетенций < 70%
     """
-    normalized_scores = merge_scores_to_current_model(scores)
-
-    recommendations = {
-        'strong_competencies': [],
-        'development_areas': [],
-        'career_paths': [],
-        'courses': [],
-        'activities': []
-    }
-    
-    # Сортировка компетенций по уровню (только те, для которых есть вопросы)
-    sorted_comps = sorted([(comp, score) for comp, score in normalized_scores.items() if score > 0],
-                         key=lambda x: x[1], reverse=True)
-    
-    # Сильные стороны (топ-3, балл >= 70%)
-    for comp, score in sorted_comps[:3]:
-        if score >= 70:
-            recommendations['strong_competencies'].append({
-                'name': COMPETENCIES[comp]['name'],
-                'score': score,
-                'description': COMPETENCIES[comp]['description']
-            })
-    
-    # Области развития (низкие баллы, < 60%)
-    for comp, score in sorted_comps:
-        if score < 60:
-            recommendations['development_areas'].append({
-                'name': COMPETENCIES[comp]['name'],
-                'score': score,
-                'description': COMPETENCIES[comp]['description']
-            })
-    
-    # Рекомендации по карьере (на основе топ-3 компетенций)
-    career_fields = set()
-    for comp, score in sorted_comps[:3]:
-        if comp in COMPETENCIES:
-            career_fields.update(COMPETENCIES[comp]['career_fields'])
-    recommendations['career_paths'] = list(career_fields)[:8]
-    
-    # Рекомендации по развитию (объединены из влитых компетенций)
-    development_map = {
-        'critical_thinking': {
-            'courses': ['Логика и аргументация', 'Анализ данных', 'Системное мышление', 'Алгоритмы', 'Системный анализ', 'Цифровые инструменты', 'Data Science', 'Дизайн-мышление', 'ТРИЗ'],
-            'activities': ['Решение кейсов', 'Участие в дискуссионных клубах', 'Чтение научной литературы', 'Олимпиады', 'Кейс-чемпионаты', 'Научные проекты', 'Онлайн-курсы', 'IT-проекты', 'Хакатоны', 'Творческие проекты']
-        },
-        'communication': {
-            'courses': ['Публичные выступления', 'Деловое общение', 'Переговоры', 'Маркетинг и реклама'],
-            'activities': ['Дебаты', 'Волонтёрство', 'Студенческие конференции', 'Творческие проекты']
-        },
-        'emotional_intelligence': {
-            'courses': ['Психология общения', 'Управление конфликтами', 'Эмпатия', 'Майндфулнесс', 'Стресс-менеджмент', 'Самоорганизация', 'Управление изменениями', 'Agile'],
-            'activities': ['Тренинги по EQ', 'Групповая терапия', 'Менторство', 'Медитация', 'Спорт', 'Йога', 'Дыхательные практики', 'Работа в стартапах', 'Новые хобби']
-        },
-        'time_management': {
-            'courses': ['Тайм-менеджмент', 'GTD', 'Продуктивность', 'Управление изменениями', 'Agile'],
-            'activities': ['Планирование дня', 'Pomodoro техника', 'Ведение дневника', 'Путешествия', 'Новые хобби']
-        },
-        'teamwork': {
-            'courses': ['Командная работа', 'Управление проектами', 'Фасилитация'],
-            'activities': ['Групповые проекты', 'Спортивные команды', 'Волонтёрство']
-        }
-    }
-    
-    # Персонализированные рекомендации (для компетенций < 70%)
-    for comp, score in sorted_comps:
-        if score < 70 and comp in development_map:
-            recommendations['courses'].extend(development_map[comp]['courses'][:3])
-            recommendations['activities'].extend(development_map[comp]['activities'][:3])
-    
-    # Удаление дубликатов с сохранением порядка
-    recommendations['courses'] = list(dict.fromkeys(recommendations['courses']))[:6]
-    recommendations['activities'] = list(dict.fromkeys(recommendations['activities']))[:6]
-    
-    return recommendations
+    return recommendation_engine.recommend(scores)
 
 # API endpoints
 @app.route('/')
@@ -253,6 +566,158 @@ def index():
             return redirect(url_for('student_dashboard'))
     return render_template('index.html')
 
+def compute_password_hash(password, prefix):
+    """Хэш пароля по параметрам из начала хэша (PasswordHasher.current_prefix)."""
+    if prefix.startswith('$2b$'):
+        salt = bcrypt.gensalt(rounds=int(prefix[4:6]))
+        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('ascii')
+    return generate_password_hash(password, method=prefix.rstrip('$'))
+
+def compute_password_hashes(passwords, prefix):
+    """Порция хэшей для пула процессов при массовом импорте."""
+    return [compute_password_hash(password, prefix) for password in passwords]
+
+class PasswordHashingBusy(Exception):
+    """Пул хэширования паролей переполнен или ожидание в очереди превысило таймаут."""
+
+class PasswordHasher:
+    """
+    Хэширование и проверка паролей в ограниченном пуле потоков.
+    scrypt, pbkdf2 и bcrypt отпускают GIL, поэтому PASSWORD_HASH_WORKERS потоков
+    загружают ядра, не блокируя остальные запросы процесса. Одновременно в пуле
+    (в работе и в очереди) не больше PASSWORD_HASH_MAX_PENDING операций; если место
+    не освободилось или операция простояла в очереди дольше PASSWORD_HASH_QUEUE_TIMEOUT_S,
+    выбрасывается PasswordHashingBusy и клиент получает 503 вместо зависшего запроса.
+    """
+
+    LATENCY_WINDOW = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self.pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.counts = {'hash': 0, 'verify': 0}
+        self._latency = {'hash': deque(maxlen=self.LATENCY_WINDOW), 'verify': deque(maxlen=self.LATENCY_WINDOW)}
+        self._wait = deque(maxlen=self.LATENCY_WINDOW)
+
+    def _ensure_started(self):
+        # Пул создаётся лениво и заново после fork рабочего процесса
+        if self._executor is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                                                    thread_name_prefix='password-hash')
+                self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+                self.pending = 0
+                self._pid = os.getpid()
+
+    @staticmethod
+    def current_prefix():
+        """Начало хэша, соответствующее текущим настройкам алгоритма и стоимости."""
+        method = app.config['PASSWORD_HASH_METHOD']
+        if method == 'bcrypt':
+            return f"$2b${app.config['PASSWORD_BCRYPT_ROUNDS']:02d}$"
+        if method == 'pbkdf2':
+            return f"pbkdf2:sha256:{app.config['PASSWORD_PBKDF2_ITERATIONS']}$"
+        return f"scrypt:{app.config['PASSWORD_SCRYPT_N']}:8:1$"
+
+    @classmethod
+    def _hash(cls, password):
+        return compute_password_hash(password, cls.current_prefix())
+
+    @staticmethod
+    def _verify(password_hash, password):
+        if password_hash.startswith('$2'):
+            return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('ascii'))
+        return check_password_hash(password_hash, password)
+
+    def _run(self, kind, func, *args):
+        self._ensure_started()
+        timeout = app.config['PASSWORD_HASH_QUEUE_TIMEOUT_S']
+        requested = time.perf_counter()
+        deadline = requested + timeout
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashingBusy()
+
+        def task():
+            started = time.perf_counter()
+            if started > deadline:
+                # Клиент уже ждал дольше таймаута: не тратим на него процессор
+                raise PasswordHashingBusy()
+            result = func(*args)
+            finished = time.perf_counter()
+            with self._lock:
+                self.counts[kind] += 1
+                self._latency[kind].append(finished - started)
+                self._wait.append(started - requested)
+            return result
+
+        with self._lock:
+            self.pending += 1
+        try:
+            return self._executor.submit(task).result()
+        except PasswordHashingBusy:
+            with self._lock:
+                self.rejected += 1
+            raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+
+    def hash_password(self, password):
+        return self._run('hash', self._hash, password)
+
+    def verify_password(self, password_hash, password):
+        return self._run('verify', self._verify, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return not password_hash.startswith(self.current_prefix())
+
+    def record_rehash(self):
+        with self._lock:
+            self.rehashed += 1
+
+    def stats(self):
+        with self._lock:
+            latency = {kind: list(values) for kind, values in self._latency.items()}
+            counts = dict(self.counts)
+            wait = list(self._wait)
+            stats = {
+                'method': self.current_prefix().rstrip('$'),
+                'workers': app.config['PASSWORD_HASH_WORKERS'],
+                'max_pending': app.config['PASSWORD_HASH_MAX_PENDING'],
+                'pending': self.pending,
+                'rejected': self.rejected,
+                'rehashed': self.rehashed
+            }
+        for kind, values in latency.items():
+            ms = np.array(values) * 1000
+            stats[kind] = {
+                'count': counts[kind],
+                'p50_ms': round(float(np.percentile(ms, 50)), 1) if len(ms) else 0,
+                'p95_ms': round(float(np.percentile(ms, 95)), 1) if len(ms) else 0,
+                'max_ms': round(float(ms.max()), 1) if len(ms) else 0
+            }
+        wait_ms = np.array(wait) * 1000
+        stats['queue_wait_p95_ms'] = round(float(np.percentile(wait_ms, 95)), 1) if len(wait_ms) else 0
+        return stats
+
+password_hasher = PasswordHasher()
+
+def password_hashing_busy_response():
+    response = jsonify({'success': False, 'message': 'Сервер перегружен, повторите попытку через несколько секунд'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '2'
+    return response
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -261,11 +726,17 @@ def register():
             return jsonify({'success': False, 'message': 'Пользователь с таким именем уже существует'})
         if User.query.filter_by(email=data['email']).first():
             return jsonify({'success': False, 'message': 'Пользователь с таким email уже существует'})
+        # Соединение с БД не удерживается, пока считается хэш
+        db.session.close()
+        try:
+            password_hash = password_hasher.hash_password(data['password'])
+        except PasswordHashingBusy:
+            return password_hashing_busy_response()
         
         user = User(
             username=data['username'],
             email=data['email'],
-            password_hash=generate_password_hash(data['password']),
+            password_hash=password_hash,
             role=data.get('role', 'student'),
             full_name=data.get('full_name'),
             faculty=data.get('faculty'),
@@ -281,7 +752,25 @@ def login():
     if request.method == 'POST':
         data = request.json
         user = User.query.filter_by(username=data['username']).first()
-        if user and check_password_hash(user.password_hash, data['password']):
+        db.session.close()
+        try:
+            valid = user is not None and password_hasher.verify_password(user.password_hash, data['password'])
+        except PasswordHashingBusy:
+            return password_hashing_busy_response()
+        if valid:
+            if password_hasher.needs_rehash(user.password_hash):
+                # Хэш устаревшего алгоритма или стоимости пересчитывается при входе;
+                # при перегрузке пула - при одном из следующих входов
+                try:
+                    new_hash = password_hasher.hash_password(data['password'])
+                except PasswordHashingBusy:
+                    new_hash = None
+                if new_hash:
+                    db.session.execute(update(User).where(
+                        User.id == user.id, User.password_hash == user.password_hash
+                    ).values(password_hash=new_hash))
+                    db.session.commit()
+                    password_hasher.record_rehash()
             session['user_id'] = user.id
             session['role'] = user.role
             return jsonify({'success': True, 'role': user.role})
@@ -299,23 +788,100 @@ def student_dashboard():
         return redirect(url_for('login'))
     user = User.query.get(session['user_id'])
     results = TestResult.query.filter_by(user_id=user.id).order_by(TestResult.test_date.desc()).all()
-    return render_template('student_dashboard.html', user=user, results=results)
+    return render_template('student_dashboard.html', user=user, results=results, competencies=COMPETENCIES)
+
+def compute_build_fingerprint():
+    """Отпечаток кода, шаблонов и статики: меняется при развёртывании новой версии страниц."""
+    digest = hashlib.sha256()
+    paths = [os.path.abspath(__file__)]
+    for folder in (app.template_folder, app.static_folder):
+        for dirpath, dirnames, filenames in os.walk(os.path.join(app.root_path, folder)):
+            dirnames.sort()
+            paths.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+    for path in paths:
+        digest.update(os.path.relpath(path, app.root_path).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+# Входит в ETag анкеты: после развёртывания браузеры не получат 304 на старую страницу
+BUILD_FINGERPRINT = compute_build_fingerprint()
+
+# Отрисованные анкеты: (вид, версия банка, роль) -> (тело, mimetype)
+_questionnaire_cache = {}
+_questionnaire_cache_lock = threading.Lock()
+
+def cached_questionnaire_response(kind, build):
+    """
+    Отдаёт анкету, закешированную для текущей версии банка вопросов,
+    со строгим ETag: повторная загрузка без изменений банка получает 304.
+    """
+    bank_version = get_question_bank_version()
+    # Роль входит в ключ: от неё зависит навигация в base.html
+    role = session.get('role')
+    etag = f'{kind}-{BUILD_FINGERPRINT}-{bank_version}-{role}'
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        key = (kind, bank_version, role)
+        with _questionnaire_cache_lock:
+            cached = _questionnaire_cache.get(key)
+        if cached is None:
+            cached = build(bank_version)
+            # Кеш общий для потоков рабочего процесса: чистка и вставка - под блокировкой
+            with _questionnaire_cache_lock:
+                for stale_key in [k for k in _questionnaire_cache if k[1] != bank_version]:
+                    del _questionnaire_cache[stale_key]
+                _questionnaire_cache[key] = cached
+        body, mimetype = cached
+        response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def load_active_questions():
+    """Активные вопросы с вариантами ответа (один selectin-запрос на варианты)."""
+    return Question.query.options(selectinload(Question.options)).filter_by(active=True).order_by(Question.order_num).all()
 
 @app.route('/test/start')
 def start_test():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    questions = Question.query.filter_by(active=True).order_by(Question.order_num).all()
-    if not questions:
-        return render_template('error.html', message='Тест пока не настроен. Обратитесь к администратору.')
-    competency_display_map = get_competency_display_map()
-    for question in questions:
-        question.display_competency = resolve_competency_key(question.competency)
-    return render_template(
-        'test.html',
-        questions=questions,
-        competency_display_map=competency_display_map
-    )
+    
+    def build(bank_version):
+        questions = load_active_questions()
+        if not questions:
+            return render_template('error.html', message='Тест пока не настроен. Обратитесь к администратору.'), 'text/html'
+        competency_display_map = get_competency_display_map()
+        for question in questions:
+            question.display_competency = resolve_competency_key(question.competency)
+        return render_template(
+            'test.html',
+            questions=questions,
+            competency_display_map=competency_display_map,
+            bank_version=bank_version
+        ), 'text/html'
+    
+    return cached_questionnaire_response('html', build)
+
+@app.route('/api/questionnaire')
+def api_questionnaire():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Не авторизован'}), 401
+    
+    def build(bank_version):
+        questions = load_active_questions()
+        return json.dumps({
+            'bank_version': bank_version,
+            'questions': [{
+                'id': q.id,
+                'text': q.text,
+                'competency': resolve_competency_key(q.competency),
+                'options': [{'id': o.id, 'text': o.text} for o in q.options]
+            } for q in questions]
+        }, ensure_ascii=False), 'application/json'
+    
+    return cached_questionnaire_response('json', build)
 
 @app.route('/test/submit', methods=['POST'])
 def submit_test():
@@ -325,140 +891,1080 @@ def submit_test():
     data = request.json
     answers = data['answers']
     
-    # Расчёт профиля компетенций
-    scores = calculate_competency_profile(answers)
+    # Тест мог быть начат по устаревшей версии банка вопросов
+    bank_version = get_question_bank_version()
+    scoring_index.sync(bank_version)
+    recommendation_engine.sync(get_counter(RECOMMENDATION_RULES_COUNTER))
+    bank_outdated = data.get('bank_version') is not None and data.get('bank_version') != bank_version
+    if bank_outdated:
+        app.logger.warning('Тест начат по версии банка %s, текущая версия %s', data.get('bank_version'), bank_version)
     
-    # Генерация рекомендаций
-    recommendations = generate_recommendations(scores)
+    # Расчёт профиля компетенций и рекомендаций
+    try:
+        submission = score_submission(session['user_id'], answers)
+    except (ValueError, KeyError, TypeError) as e:
+        if bank_outdated:
+            return jsonify({'success': False, 'bank_outdated': True,
+                            'message': 'Вопросы теста изменились. Пожалуйста, пройдите тест заново.'}), 409
+        return jsonify({'success': False, 'message': f'Некорректные ответы: {e}'}), 400
     
     # Сохранение результатов
-    result = TestResult(
-        user_id=session['user_id'],
-        answers=json.dumps(answers, ensure_ascii=False),
-        scores=json.dumps(scores, ensure_ascii=False),
-        recommendations=json.dumps(recommendations, ensure_ascii=False),
-        profile_data=json.dumps({'scores': scores, 'timestamp': datetime.now().isoformat()}, ensure_ascii=False)
-    )
-    db.session.add(result)
-    db.session.commit()
+    if app.config['SUBMISSION_GROUP_COMMIT']:
+        # Соединение возвращается в пул, пока обработчик ждёт поток-писатель
+        db.session.close()
+        try:
+            result_id = submission_writer.submit(submission, timeout=app.config['SUBMISSION_GROUP_TIMEOUT_S'])
+        except FutureTimeoutError:
+            return jsonify({'success': False, 'message': 'Сервер перегружен, попробуйте отправить ещё раз'}), 503
+    else:
+        result_id = insert_test_results([submission])[0]
+        db.session.commit()
     
     return jsonify({
         'success': True,
-        'result_id': result.id,
-        'scores': scores,
-        'recommendations': recommendations
+        'result_id': result_id,
+        'scores': submission.scores,
+        'recommendations': submission.recommendations,
+        'bank_version': bank_version,
+        'bank_outdated': bank_outdated
     })
 
-@app.route('/results/<int:result_id>')
-def view_results(result_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    result = TestResult.query.get_or_404(result_id)
-    
-    # Проверка прав доступа
-    if result.user_id != session['user_id'] and session['role'] not in ['teacher', 'admin']:
-        return "Доступ запрещён", 403
-    
-    raw_scores = json.loads(result.scores)
-    scores = merge_scores_to_current_model(raw_scores)
-    recommendations = json.loads(result.recommendations)
-    
-    return render_template('results.html',
-                         result=result,
-                         scores=scores,
-                         recommendations=recommendations,
-                         competencies=COMPETENCIES)
+class SubmissionWriter:
+    """
+    Групповая запись результатов (включается SUBMISSION_GROUP_COMMIT).
+    Обработчики запросов кладут оценённые результаты в очередь и ждут id,
+    единственный поток-писатель сохраняет их группами до SUBMISSION_GROUP_MAX_SIZE
+    одной транзакцией, ожидая пополнения группы не дольше SUBMISSION_GROUP_MAX_WAIT_MS.
+    """
 
-@app.route('/teacher/dashboard')
-def teacher_dashboard():
-    if 'user_id' not in session or session['role'] != 'teacher':
-        return redirect(url_for('login'))
-    
-    # Обезличенная статистика
-    all_results = TestResult.query.all()
-    stats = calculate_aggregate_stats(all_results)
-    
-    # Профили всех студентов
-    students = User.query.filter_by(role='student').all()
-    student_profiles = []
-    for student in students:
-        ordered_results = sorted(
-            student.test_results,
-            key=lambda r: r.test_date or datetime.min,
-            reverse=True
-        )
-        last_result = ordered_results[0] if ordered_results else None
-        student_profiles.append({
-            'id': student.id,
-            'display_name': student.full_name or student.username,
-            'username': student.username,
-            'faculty': student.faculty,
-            'course': student.course,
-            'profile_visibility': student.profile_visibility,
-            'results_count': len(ordered_results),
-            'last_result_id': last_result.id if last_result else None,
-            'last_result_date': last_result.test_date if last_result else None
-        })
-    
-    return render_template(
-        'teacher_dashboard.html',
-        stats=stats,
-        competencies=COMPETENCIES,
-        student_profiles=student_profiles
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.commits = 0
+        self.committed = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+
+    def _ensure_started(self):
+        # Поток запускается лениво и заново после fork рабочего процесса
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='submission-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, submission, timeout=None):
+        """
+        Ставит результат в очередь и возвращает его id после commit группы.
+        FutureTimeoutError - результат так и не попал в группу и не будет сохранён.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((submission, future))
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Отменённый результат писатель пропустит, и повторная отправка не создаст дубликат
+            if future.cancel():
+                raise
+            # Группа с результатом уже записывается - ждём её ещё не дольше timeout
+            return future.result(timeout)
+
+    def _run(self):
+        max_size = app.config['SUBMISSION_GROUP_MAX_SIZE']
+        max_wait = app.config['SUBMISSION_GROUP_MAX_WAIT_MS'] / 1000
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get())
+                deadline = time.monotonic() + max_wait
+                while len(batch) < max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                # Результаты, которые обработчики перестали ждать (отменены по таймауту), не записываются
+                batch = [(submission, future) for submission, future in batch if future.set_running_or_notify_cancel()]
+                if batch:
+                    self._write(batch)
+            except Exception as e:
+                # Поток-писатель не должен завершаться: ожидающие обработчики получают ошибку
+                app.logger.exception('Ошибка потока групповой записи')
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _write(self, batch):
+        with app.app_context():
+            try:
+                result_ids = insert_test_results([submission for submission, _ in batch])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Ошибка групповой записи, результаты сохраняются по одному')
+                for submission, future in batch:
+                    try:
+                        result_id = insert_test_results([submission])[0]
+                        db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        future.set_exception(e)
+                    else:
+                        self._record_commit(1)
+                        future.set_result(result_id)
+                return
+        self._record_commit(len(batch))
+        for (_, future), result_id in zip(batch, result_ids):
+            future.set_result(result_id)
+
+    def _record_commit(self, size):
+        self.commits += 1
+        self.committed += size
+        self.last_batch_size = size
+        self.max_batch_size = max(self.max_batch_size, size)
+
+    def stats(self):
+        return {
+            'enabled': app.config['SUBMISSION_GROUP_COMMIT'],
+            'queue_depth': self._queue.qsize(),
+            'commits': self.commits,
+            'committed_results': self.committed,
+            'last_batch_size': self.last_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'avg_batch_size': round(self.committed / self.commits, 2) if self.commits else 0
+        }
+
+submission_writer = SubmissionWriter()
+
+@app.route('/admin/metrics/submissions')
+def submission_metrics():
+    if 'user_id' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    return jsonify(submission_writer.stats())
+
+@app.route('/admin/metrics/passwords')
+def password_metrics():
+    if 'user_id' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    return jsonify(password_hasher.stats())
+
+class RequestMetrics:
+    """
+    Метрики запросов по эндпоинтам в памяти процесса: гистограммы общего времени, времени
+    в БД, времени отрисовки шаблонов и числа SQL-запросов. SQL и шаблоны замеряются событиями
+    SQLAlchemy и сигналами Flask в потоке запроса; запросы фоновых потоков не учитываются.
+    У каждого рабочего процесса gunicorn свои гистограммы.
+    """
+
+    SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+    HISTOGRAMS = (
+        ('app_request_duration_seconds', 'Время обработки запроса', SECONDS_BUCKETS),
+        ('app_request_db_seconds', 'Время выполнения SQL-запросов за запрос', SECONDS_BUCKETS),
+        ('app_request_template_seconds', 'Время отрисовки шаблонов за запрос', SECONDS_BUCKETS),
+        ('app_request_queries', 'Число SQL-запросов за запрос', QUERY_BUCKETS)
     )
 
-@app.route('/admin/dashboard')
-def admin_dashboard():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {name: {} for name, _, _ in self.HISTOGRAMS}
+        self._over_budget = {}
+
+    def current(self):
+        """Счётчики текущего запроса этого потока или None вне запроса."""
+        return getattr(self._local, 'request', None)
+
+    def start_request(self):
+        self._local.request = {'started': time.perf_counter(), 'queries': 0, 'db': 0.0, 'template': 0.0}
+
+    def finish_request(self, endpoint):
+        stats = self.current()
+        if stats is None:
+            return None
+        self._local.request = None
+        values = {
+            'app_request_duration_seconds': time.perf_counter() - stats['started'],
+            'app_request_db_seconds': stats['db'],
+            'app_request_template_seconds': stats['template'],
+            'app_request_queries': stats['queries']
+        }
+        with self._lock:
+            for name, _, buckets in self.HISTOGRAMS:
+                histogram = self._histograms[name].setdefault(endpoint, [[0] * (len(buckets) + 1), 0.0])
+                histogram[0][bisect_left(buckets, values[name])] += 1
+                histogram[1] += values[name]
+        return values
+
+    def record_over_budget(self, endpoint, budget):
+        with self._lock:
+            self._over_budget[(endpoint, budget)] = self._over_budget.get((endpoint, budget), 0) + 1
+
+    def prometheus(self):
+        """Метрики в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            for name, description, buckets in self.HISTOGRAMS:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for endpoint, (counts, total) in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {total:g}')
+                    lines.append(f'{name}_count{{endpoint="{endpoint}"}} {cumulative}')
+            lines.append('# HELP app_requests_over_budget_total Запросы сверх бюджета числа SQL-запросов или времени')
+            lines.append('# TYPE app_requests_over_budget_total counter')
+            for (endpoint, budget), count in sorted(self._over_budget.items()):
+                lines.append(f'app_requests_over_budget_total{{endpoint="{endpoint}",budget="{budget}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if request_metrics.current() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    stats = request_metrics.current()
+    if stats is not None and conn.info.get('query_started'):
+        duration = time.perf_counter() - conn.info['query_started'].pop()
+        stats['queries'] += 1
+        stats['db'] += duration
+        if 'statements' in stats:
+            # Запрос профилируется (RequestProfiler)
+            stats['statements'].append((statement, duration))
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    stats = request_metrics.current()
+    if stats is not None:
+        stats.setdefault('template_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    stats = request_metrics.current()
+    if stats is not None and stats.get('template_started'):
+        stats['template'] += time.perf_counter() - stats['template_started'].pop()
+
+@app.before_request
+def start_request_metrics():
+    request_metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    # Для потоковых ответов (выгрузка) учитывается время до начала передачи тела
+    endpoint = request.endpoint or 'unknown'
+    values = request_metrics.finish_request(endpoint)
+    if values is None:
+        return response
+    duration_ms = values['app_request_duration_seconds'] * 1000
+    if values['app_request_queries'] > app.config['REQUEST_QUERY_BUDGET']:
+        request_metrics.record_over_budget(endpoint, 'queries')
+        app.logger.warning('%s %s: %d SQL-запросов (бюджет %d)', request.method, request.path,
+                           values['app_request_queries'], app.config['REQUEST_QUERY_BUDGET'])
+    if duration_ms > app.config['REQUEST_LATENCY_BUDGET_MS']:
+        request_metrics.record_over_budget(endpoint, 'latency')
+        app.logger.warning('%s %s: %.0f мс (бюджет %d мс, БД %.0f мс, шаблоны %.0f мс)', request.method, request.path,
+                           duration_ms, app.config['REQUEST_LATENCY_BUDGET_MS'],
+                           values['app_request_db_seconds'] * 1000, values['app_request_template_seconds'] * 1000)
+    return response
+
+@app.route('/admin/metrics')
+def request_metrics_endpoint():
+    if 'user_id' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    return Response(request_metrics.prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Сколько строк статистики cProfile попадает в сохранённый профиль
+PROFILE_STATS_LINES = 60
+
+class RequestProfiler:
+    """
+    Выборочное профилирование запросов, включаемое администратором без перезапуска.
+    Настройки (эндпоинт или путь, доля запросов в процентах, срок действия) хранятся в файле
+    PROFILE_DIR/settings.json, поэтому действуют во всех рабочих процессах. Выбранный запрос
+    выполняется под cProfile; отчёт со статистикой функций и SQL-запросами сохраняется в PROFILE_DIR,
+    старые отчёты удаляются сверх PROFILE_MAX_FILES файлов или PROFILE_MAX_MB мегабайт.
+    В процессе одновременно профилируется не больше одного запроса.
+    """
+
+    SETTINGS_FILE = 'settings.json'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        self._local = threading.local()
+        self._settings = None
+        self._settings_mtime = None
+
+    @staticmethod
+    def directory():
+        return app.config['PROFILE_DIR']
+
+    def settings(self):
+        """Текущие настройки; файл перечитывается только при изменении."""
+        path = os.path.join(self.directory(), self.SETTINGS_FILE)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if mtime != self._settings_mtime:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    settings = json.load(f)
+            except (OSError, ValueError):
+                return None
+            with self._lock:
+                self._settings, self._settings_mtime = settings, mtime
+        return self._settings
+
+    def configure(self, target, percent, minutes):
+        """Включает профилирование target (эндпоинт, путь или None - все запросы) на minutes минут."""
+        settings = {
+            'target': target,
+            'percent': percent,
+            'expires': (datetime.utcnow() + timedelta(minutes=minutes)).isoformat()
+        }
+        os.makedirs(self.directory(), exist_ok=True)
+        path = os.path.join(self.directory(), self.SETTINGS_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(settings, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+        return settings
+
+    def disable(self):
+        try:
+            os.remove(os.path.join(self.directory(), self.SETTINGS_FILE))
+        except FileNotFoundError:
+            pass
+
+    def should_profile(self):
+        settings = self.settings()
+        if not settings or datetime.fromisoformat(settings['expires']) < datetime.utcnow():
+            return False
+        target = settings.get('target')
+        if target and target not in (request.endpoint, request.url_rule.rule if request.url_rule else None, request.path):
+            return False
+        return random.random() * 100 < settings['percent']
+
+    def start(self):
+        if not self._active.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        self._local.profile = profile
+        stats = request_metrics.current()
+        if stats is not None:
+            stats['statements'] = []
+        profile.enable()
+
+    def finish(self, response, stats):
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        self._local.profile = None
+        self._active.release()
+        try:
+            self._save(profile, response, stats)
+        except OSError:
+            app.logger.exception('Не удалось сохранить профиль запроса')
+
+    def _save(self, profile, response, stats):
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(PROFILE_STATS_LINES)
+        statements = (stats or {}).get('statements', [])
+        duration_ms = (time.perf_counter() - stats['started']) * 1000 if stats else 0
+        lines = [
+            f'{request.method} {request.full_path.rstrip("?")} -> {response.status_code}',
+            f'Эндпоинт: {request.endpoint}',
+            f'Время: {datetime.utcnow().isoformat()} UTC, {duration_ms:.1f} мс, '
+            f'SQL-запросов: {len(statements)}, в БД: {sum(d for _, d in statements) * 1000:.1f} мс',
+            '',
+            'SQL-запросы (мс):'
+        ]
+        lines.extend(f'{duration * 1000:8.2f}  {" ".join(statement.split())}' for statement, duration in statements)
+        lines.extend(['', 'cProfile:', output.getvalue()])
+        
+        directory = self.directory()
+        os.makedirs(directory, exist_ok=True)
+        name = f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')}-{request.endpoint or 'unknown'}-{os.getpid()}.txt"
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+        self._rotate()
+
+    def list_profiles(self):
+        """Сохранённые профили, новые первыми: [{'name', 'size', 'created'}]."""
+        try:
+            entries = [entry for entry in os.scandir(self.directory())
+                       if entry.is_file() and entry.name.endswith('.txt')]
+        except FileNotFoundError:
+            return []
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        return [{
+            'name': entry.name,
+            'size': entry.stat().st_size,
+            'created': datetime.fromtimestamp(entry.stat().st_mtime)
+        } for entry in entries]
+
+    def _rotate(self):
+        max_files = app.config['PROFILE_MAX_FILES']
+        max_bytes = app.config['PROFILE_MAX_MB'] * 1024 * 1024
+        total = 0
+        for index, profile in enumerate(self.list_profiles()):
+            total += profile['size']
+            if index >= max_files or total > max_bytes:
+                try:
+                    os.remove(os.path.join(self.directory(), profile['name']))
+                except FileNotFoundError:
+                    pass
+
+request_profiler = RequestProfiler()
+
+@app.before_request
+def start_request_profiling():
+    if request.endpoint != 'static' and request_profiler.should_profile():
+        request_profiler.start()
+
+@app.after_request
+def finish_request_profiling(response):
+    # Выполняется до record_request_metrics: счётчики запроса ещё не сброшены
+    request_profiler.finish(response, request_metrics.current())
+    return response
+
+@app.route('/admin/profiles', methods=['GET', 'POST'])
+def admin_profiles():
+    """
+    Страница профилирования. POST (JSON): {"enabled": true, "target": эндпоинт или путь,
+    "percent": доля запросов, "minutes": срок} включает выборочное профилирование, {"enabled": false} - выключает.
+    """
     if 'user_id' not in session or session['role'] != 'admin':
+        if request.method == 'POST':
+            return jsonify({'success': False, 'message': 'Доступ запрещён'})
         return redirect(url_for('login'))
     
-    users = User.query.all()
-    questions = Question.query.order_by(Question.order_num).all()
-    stats = {
-        'total_users': User.query.count(),
-        'total_tests': TestResult.query.count(),
-        'total_questions': Question.query.filter_by(active=True).count()
-    }
-    competency_display_map = get_competency_display_map()
-    questions_payload = []
-    for question in questions:
-        resolved_key = resolve_competency_key(question.competency)
-        question.display_competency = resolved_key
-        questions_payload.append({
-            'id': question.id,
-            'text': question.text,
-            'competency': question.competency,
-            'resolved_competency': resolved_key,
-            'category': question.category,
-            'order_num': question.order_num,
-            'active': question.active,
-            'options': [{
-                'id': option.id,
-                'text': option.text,
-                'score': option.score,
-                'order_num': option.order_num
-            } for option in sorted(question.options, key=lambda o: o.order_num or 0)]
-        })
+    if request.method == 'POST':
+        data = request.json or {}
+        if not data.get('enabled'):
+            request_profiler.disable()
+            return jsonify({'success': True, 'settings': None})
+        try:
+            percent = float(data.get('percent', 100))
+            minutes = int(data.get('minutes', 30))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'percent и minutes должны быть числами'}), 400
+        if not 0 < percent <= 100 or minutes <= 0:
+            return jsonify({'success': False, 'message': 'percent - от 0 до 100, minutes - больше 0'}), 400
+        settings = request_profiler.configure((data.get('target') or '').strip() or None, percent, minutes)
+        return jsonify({'success': True, 'settings': settings})
     
     return render_template(
-        'admin_dashboard.html',
-        users=users,
-        questions=questions,
-        stats=stats,
-        competencies=COMPETENCIES,
-        competency_display_map=competency_display_map,
-        questions_data=questions_payload
+        'admin_profiles.html',
+        settings=request_profiler.settings(),
+        profiles=request_profiler.list_profiles()
     )
 
-@app.route('/admin/questions', methods=['GET', 'POST', 'PUT', 'DELETE'])
-def manage_questions():
+@app.route('/admin/profiles/<name>')
+def download_profile(name):
+    if 'user_id' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+    # Отдаются только отчёты профилирования, но не файл настроек
+    if name not in {profile['name'] for profile in request_profiler.list_profiles()}:
+        return 'Профиль не найден', 404
+    return send_from_directory(request_profiler.directory(), name, as_attachment=True, mimetype='text/plain')
+
+# Размер транзакции при пакетной загрузке результатов
+SUBMIT_BATCH_CHUNK_SIZE = 500
+
+def parse_taken_at(value):
+    """ISO-дата бланка в наивное время UTC, как test_date; дата со смещением переводится в UTC."""
+    if not isinstance(value, str):
+        raise ValueError('taken_at: ожидается строка с датой ISO 8601')
+    try:
+        taken_at = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        raise ValueError(f'taken_at: некорректная дата {value!r}')
+    if taken_at.tzinfo is not None:
+        taken_at = taken_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return taken_at
+
+@app.route('/test/submit_batch', methods=['POST'])
+def submit_test_batch():
+    """
+    Пакетная загрузка бланков (бумажное или офлайн-тестирование).
+    Тело: {"records": [{"user_id" | "username", "answers": [...], "taken_at": ISO-дата}]}.
+    Все записи оцениваются в памяти, вставляются порциями по SUBMIT_BATCH_CHUNK_SIZE
+    в отдельных транзакциях; в ответе - отчёт по каждой записи.
+    """
     if 'user_id' not in session or session['role'] != 'admin':
         return jsonify({'success': False, 'message': 'Доступ запрещён'})
     
-    if request.method == 'POST':
-        data = request.json
-        question = Question(
+    records = (request.json or {}).get('records')
+    if not isinstance(records, list):
+        return jsonify({'success': False, 'message': 'Ожидается список records'}), 400
+    
+    scoring_index.sync(get_question_bank_version())
+    recommendation_engine.sync(get_counter(RECOMMENDATION_RULES_COUNTER))
+    
+    # Пользователи разрешаются двумя запросами на весь пакет; значения других типов
+    # в запросы не попадают и отклоняются при разборе записи
+    usernames = {r['username'] for r in records if isinstance(r, dict) and isinstance(r.get('username'), str) and r['username']}
+    user_ids = {r['user_id'] for r in records if isinstance(r, dict) and type(r.get('user_id')) is int}
+    ids_by_username = dict(db.session.query(User.username, User.id).filter(User.username.in_(usernames)).all()) if usernames else {}
+    known_ids = {uid for (uid,) in db.session.query(User.id).filter(User.id.in_(user_ids)).all()} if user_ids else set()
+    
+    report = [None] * len(records)
+    pending = []
+    for index, record in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise ValueError('запись должна быть объектом')
+            if record.get('username'):
+                user_id = ids_by_username.get(record['username']) if isinstance(record['username'], str) else None
+            else:
+                user_id = record.get('user_id') if type(record.get('user_id')) is int and record['user_id'] in known_ids else None
+            if user_id is None:
+                raise ValueError('пользователь не найден')
+            taken_at = parse_taken_at(record['taken_at']) if record.get('taken_at') else None
+            pending.append((index, score_submission(user_id, record['answers'], taken_at)))
+        except (ValueError, KeyError, TypeError) as e:
+            report[index] = {'index': index, 'success': False, 'message': str(e)}
+    
+    for start in range(0, len(pending), SUBMIT_BATCH_CHUNK_SIZE):
+        chunk = pending[start:start + SUBMIT_BATCH_CHUNK_SIZE]
+        try:
+            result_ids = insert_test_results([submission for _, submission in chunk])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for index, _ in chunk:
+                report[index] = {'index': index, 'success': False, 'message': f'Ошибка сохранения: {e}'}
+            continue
+        for (index, _), result_id in zip(chunk, result_ids):
+            report[index] = {'index': index, 'success': True, 'result_id': result_id}
+    
+    inserted = sum(1 for entry in report if entry['success'])
+    return jsonify({
+        'success': True,
+        'inserted': inserted,
+        'failed': len(report) - inserted,
+        'results': report
+    })
+
+# Порция вставки при массовом импорте студентов
+STUDENT_IMPORT_CHUNK_SIZE = 1000
+
+def read_students_csv(text):
+    """Строки CSV (разделитель "," или ";") в виде пар (номер строки, словарь)."""
+    text = text.lstrip('\ufeff')
+    try:
+        dialect = csv.Sniffer().sniff(text.split('\n', 1)[0], delimiters=',;')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    missing = {'username', 'email'} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"В CSV нет колонок: {', '.join(sorted(missing))}")
+    return [(reader.line_num, row) for row in reader]
+
+def hash_passwords_parallel(passwords, processes=None):
+    """Хэширует пароли текущим алгоритмом в пуле из processes процессов."""
+    prefix = PasswordHasher.current_prefix()
+    processes = processes or app.config['PASSWORD_IMPORT_PROCESSES']
+    if processes <= 1 or len(passwords) < 2 * processes:
+        return compute_password_hashes(passwords, prefix)
+    size = -(-len(passwords) // (processes * 4))
+    chunks = [passwords[start:start + size] for start in range(0, len(passwords), size)]
+    # Процессы порождаются сервером forkserver, а не fork многопоточного рабочего процесса:
+    # блокировки, захваченные другими потоками (логирование, пул соединений), в копию не попадут
+    context = multiprocessing.get_context('forkserver')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        return [h for part in executor.map(compute_password_hashes, chunks, [prefix] * len(chunks)) for h in part]
+
+def import_students(rows, processes=None):
+    """
+    Массовое создание студентов из строк CSV (username, email, full_name, faculty, course
+    и необязательно password). Уникальность проверяется для всего пакета запросами IN,
+    пароли (из файла или сгенерированные) хэшируются в пуле процессов, пользователи
+    вставляются транзакциями по STUDENT_IMPORT_CHUNK_SIZE.
+    Возвращает {'created': [...], 'rejected': [...]} с номерами строк файла.
+    """
+    rejected = []
+    candidates = []
+    usernames, emails = set(), set()
+    for line, row in rows:
+        username = (row.get('username') or '').strip()
+        email = (row.get('email') or '').strip()
+        course = (row.get('course') or '').strip()
+        if not username or not email:
+            message = 'не указаны username или email'
+        elif '@' not in email:
+            message = 'некорректный email'
+        elif course and not course.isdigit():
+            message = 'курс должен быть числом'
+        elif username in usernames:
+            message = 'username повторяется в файле'
+        elif email in emails:
+            message = 'email повторяется в файле'
+        else:
+            usernames.add(username)
+            emails.add(email)
+            candidates.append({
+                'line': line,
+                'username': username,
+                'email': email,
+                'full_name': (row.get('full_name') or '').strip() or None,
+                'faculty': (row.get('faculty') or '').strip() or None,
+                'course': int(course) if course else None,
+                'password': (row.get('password') or '').strip() or None
+            })
+            continue
+        rejected.append({'line': line, 'username': username, 'message': message})
+    
+    # Уже занятые имена и email - по запросу на порцию значений, а не на строку
+    taken = {'username': set(), 'email': set()}
+    for column, values in ((User.username, usernames), (User.email, emails)):
+        values = list(values)
+        for start in range(0, len(values), STUDENT_IMPORT_CHUNK_SIZE):
+            taken[column.key].update(db.session.scalars(
+                select(column).where(column.in_(values[start:start + STUDENT_IMPORT_CHUNK_SIZE]))
+            ))
+    accepted = []
+    for candidate in candidates:
+        if candidate['username'] in taken['username']:
+            rejected.append({'line': candidate['line'], 'username': candidate['username'],
+                             'message': 'пользователь с таким именем уже существует'})
+        elif candidate['email'] in taken['email']:
+            rejected.append({'line': candidate['line'], 'username': candidate['username'],
+                             'message': 'пользователь с таким email уже существует'})
+        else:
+            accepted.append(candidate)
+    db.session.close()
+    
+    generated = [candidate['password'] is None for candidate in accepted]
+    passwords = [candidate['password'] or secrets.token_urlsafe(9) for candidate in accepted]
+    hashes = hash_passwords_parallel(passwords, processes)
+    
+    def user_row(candidate, password_hash):
+        return {
+            'username': candidate['username'],
+            'email': candidate['email'],
+            'password_hash': password_hash,
+            'role': 'student',
+            'full_name': candidate['full_name'],
+            'faculty': candidate['faculty'],
+            'course': candidate['course']
+        }
+    
+    created = []
+    items = list(zip(accepted, passwords, hashes, generated))
+    for start in range(0, len(items), STUDENT_IMPORT_CHUNK_SIZE):
+        chunk = items[start:start + STUDENT_IMPORT_CHUNK_SIZE]
+        try:
+            db.session.execute(insert(User), [user_row(candidate, password_hash) for candidate, _, password_hash, _ in chunk])
+            db.session.commit()
+            saved = chunk
+        except Exception:
+            # Кто-то зарегистрировался параллельно: порция сохраняется по одному
+            db.session.rollback()
+            saved = []
+            for item in chunk:
+                candidate, _, password_hash, _ = item
+                try:
+                    db.session.execute(insert(User), [user_row(candidate, password_hash)])
+                    db.session.commit()
+                    saved.append(item)
+                except Exception as e:
+                    db.session.rollback()
+                    rejected.append({'line': candidate['line'], 'username': candidate['username'],
+                                     'message': f'Ошибка сохранения: {e.__class__.__name__}'})
+        for candidate, password, _, is_generated in saved:
+            entry = {'line': candidate['line'], 'username': candidate['username']}
+            if is_generated:
+                entry['password'] = password
+            created.append(entry)
+    
+    rejected.sort(key=lambda entry: entry['line'])
+    return {'created': created, 'rejected': rejected}
+
+@app.route('/admin/students/import', methods=['POST'])
+def import_students_endpoint():
+    """
+    Импорт студентов из CSV: файл в поле file (multipart) или тело запроса text/csv.
+    В ответе - созданные пользователи со сгенерированными паролями и отклонённые строки.
+    """
+    if 'user_id' not in session or session['role'] != 'admin':
+        return jsonify({'success': False, 'message': 'Доступ запрещён'})
+    
+    upload = request.files.get('file')
+    try:
+        text = upload.read().decode('utf-8') if upload else request.get_data().decode('utf-8')
+        rows = read_students_csv(text)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    report = import_students(rows)
+    return jsonify({
+        'success': True,
+        'created': len(report['created']),
+        'rejected': len(report['rejected']),
+        'users': report['created'],
+        'errors': report['rejected']
+    })
+
+@app.route('/results/<int:result_id>')
+def view_results(result_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    result = TestResult.query.get_or_404(result_id)
+    
+    # Проверка прав доступа
+    if result.user_id != session['user_id'] and session['role'] not in ['teacher', 'admin']:
+        return "Доступ запрещён", 403
+    
+    scores = read_result_scores(result.scores, result.scores_version)
+    recommendations = read_recommendations(result.recommendations, result.recommendation_hash, scores)
+    percentiles = get_percentile_ranks(scores, result.user.faculty, result.user.course)
+    
+    return render_template('results.html',
+                         result=result,
+                         scores=scores,
+                         recommendations=recommendations,
+                         percentiles=percentiles,
+                         competencies=COMPETENCIES)
+
+@app.route('/api/results/<int:result_id>/percentiles')
+def api_result_percentiles(result_id):
+    """Перцентильные ранги результата среди всех, на факультете, на курсе и на курсе факультета."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Не авторизован'}), 401
+    
+    result = TestResult.query.get_or_404(result_id)
+    if result.user_id != session['user_id'] and session['role'] not in ['teacher', 'admin']:
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    
+    scores = read_result_scores(result.scores, result.scores_version)
+    return jsonify({
+        'result_id': result.id,
+        'scores': scores,
+        'percentiles': get_percentile_ranks(scores, result.user.faculty, result.user.course)
+    })
+
+# Размер страницы списка студентов на дашборде преподавателя
+STUDENTS_PAGE_SIZE = 50
+
+def get_student_filters(args):
+    """Фильтры списка студентов из параметров запроса."""
+    visibility = args.get('visibility')
+    return {
+        'faculty': args.get('faculty') or None,
+        'course': args.get('course', type=int),
+        'visibility': {'public': True, 'private': False}.get(visibility)
+    }
+
+def fetch_student_page(after_id=None, faculty=None, course=None, visibility=None, limit=STUDENTS_PAGE_SIZE):
+    """
+    Страница профилей студентов с keyset-пагинацией по id.
+    Число тестов и последний результат берутся оконной функцией в том же запросе,
+    без загрузки test_results каждого студента. Возвращает (профили, курсор следующей страницы).
+    """
+    page_query = select(User.id).where(User.role == 'student')
+    if after_id:
+        page_query = page_query.where(User.id > after_id)
+    if faculty:
+        page_query = page_query.where(User.faculty == faculty)
+    if course:
+        page_query = page_query.where(User.course == course)
+    if visibility is not None:
+        page_query = page_query.where(User.profile_visibility == visibility)
+    page = page_query.order_by(User.id).limit(limit + 1).subquery()
+    
+    ranked = select(
+        TestResult.user_id,
+        TestResult.id.label('result_id'),
+        TestResult.test_date,
+        func.count().over(partition_by=TestResult.user_id).label('results_count'),
+        func.row_number().over(
+            partition_by=TestResult.user_id,
+            order_by=(TestResult.test_date.desc(), TestResult.id.desc())
+        ).label('rn')
+    ).where(TestResult.user_id.in_(select(page.c.id))).subquery()
+    
+    rows = db.session.execute(
+        select(
+            User.id, User.full_name, User.username, User.faculty, User.course, User.profile_visibility,
+            ranked.c.results_count, ranked.c.result_id, ranked.c.test_date
+        )
+        .join(page, page.c.id == User.id)
+        .outerjoin(ranked, and_(ranked.c.user_id == User.id, ranked.c.rn == 1))
+        .order_by(User.id)
+    ).all()
+    
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    student_profiles = [{
+        'id': row.id,
+        'display_name': row.full_name or row.username,
+        'username': row.username,
+        'faculty': row.faculty,
+        'course': row.course,
+        'profile_visibility': bool(row.profile_visibility),
+        'results_count': row.results_count or 0,
+        'last_result_id': row.result_id,
+        'last_result_date': row.test_date
+    } for row in rows[:limit]]
+    return student_profiles, next_cursor
+
+@app.route('/teacher/dashboard')
+def teacher_dashboard():
+    if 'user_id' not in session or session['role'] != 'teacher':
+        return redirect(url_for('login'))
+    
+    filters = get_student_filters(request.args)
+    
+    # Обезличенная статистика (по срезу факультета/курса - запросом к CompetencyScore)
+    if filters['faculty'] or filters['course']:
+        stats = calculate_aggregate_stats(faculty=filters['faculty'], course=filters['course'])
+    else:
+        stats = get_aggregate_stats()
+    
+    # Первая страница профилей студентов, остальные подгружаются через /api/teacher/students
+    student_profiles, next_cursor = fetch_student_page(**filters)
+    
+    return render_template(
+        'teacher_dashboard.html',
+        stats=stats,
+        competencies=COMPETENCIES,
+        student_profiles=student_profiles,
+        next_cursor=next_cursor,
+        filters=request.args
+    )
+
+@app.route('/api/teacher/students')
+def api_teacher_students():
+    if 'user_id' not in session or session['role'] != 'teacher':
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    
+    student_profiles, next_cursor = fetch_student_page(
+        after_id=request.args.get('after', type=int),
+        limit=max(1, min(request.args.get('limit', STUDENTS_PAGE_SIZE, type=int), 200)),
+        **get_student_filters(request.args)
+    )
+    for profile in student_profiles:
+        if profile['last_result_date']:
+            profile['last_result_date'] = profile['last_result_date'].isoformat()
+        if profile['last_result_id']:
+            profile['last_result_url'] = url_for('view_results', result_id=profile['last_result_id'])
+    return jsonify({'students': student_profiles, 'next_cursor': next_cursor})
+
+# Размер страницы списков пользователей и вопросов в админ-панели
+ADMIN_PAGE_SIZE = 25
+
+USER_SORT_COLUMNS = {
+    'name': func.coalesce(User.full_name, User.username),
+    'username': User.username,
+    'role': User.role,
+    'faculty': User.faculty,
+    'course': User.course,
+    'created': User.created_at
+}
+
+QUESTION_SORT_COLUMNS = {
+    'order': Question.order_num,
+    'competency': Question.competency,
+    'text': Question.text,
+    'created': Question.id
+}
+
+def serialize_question(question):
+    return {
+        'id': question.id,
+        'text': question.text,
+        'competency': question.competency,
+        'resolved_competency': resolve_competency_key(question.competency),
+        'category': question.category,
+        'order_num': question.order_num,
+        'active': question.active,
+        'options': [{
+            'id': option.id,
+            'text': option.text,
+            'score': option.score,
+            'order_num': option.order_num
+        } for option in sorted(question.options, key=lambda o: (o.order_num or 0, o.id))]
+    }
+
+def fetch_admin_page(query, id_column, args, sort_columns, default_sort):
+    """
+    Страница списка админ-панели: сортировка sort (ключ sort_columns) и order (asc/desc),
+    пагинация page/per_page. Возвращает (строки, описание страницы) или ValueError.
+    """
+    sort = args.get('sort', default_sort)
+    if sort not in sort_columns:
+        raise ValueError(f"Сортировка возможна по полям: {', '.join(sort_columns)}")
+    column = sort_columns[sort]
+    if args.get('order') == 'desc':
+        ordering = (column.desc(), id_column.desc())
+    else:
+        ordering = (column.asc(), id_column.asc())
+    page = max(args.get('page', 1, type=int), 1)
+    per_page = max(1, min(args.get('per_page', ADMIN_PAGE_SIZE, type=int), 200))
+    total = db.session.scalar(select(func.count()).select_from(query.subquery()))
+    rows = db.session.scalars(query.order_by(*ordering).offset((page - 1) * per_page).limit(per_page)).all()
+    return rows, {'page': page, 'per_page': per_page, 'total': total, 'pages': -(-total // per_page)}
+
+@app.route('/admin/dashboard')
+def admin_dashboard():
+    """Каркас админ-панели: счётчики, списки пользователей и вопросов подгружаются постранично."""
+    if 'user_id' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+    
+    stats = {
+        'total_users': db.session.scalar(select(func.count(User.id))),
+        'total_tests': db.session.scalar(select(func.count(TestResult.id))),
+        'total_questions': db.session.scalar(select(func.count(Question.id)).where(Question.active.is_(True)))
+    }
+    return render_template(
+        'admin_dashboard.html',
+        stats=stats,
+        competencies=COMPETENCIES,
+        roles=['student', 'teacher', 'admin'],
+        page_size=ADMIN_PAGE_SIZE
+    )
+
+@app.route('/api/admin/users')
+def api_admin_users():
+    """
+    Пользователи постранично. Фильтры: q (логин, ФИО или email), role, faculty, course;
+    сортировка sort (name, username, role, faculty, course, created) и order.
+    """
+    if 'user_id' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    
+    query = select(User)
+    search = (request.args.get('q') or '').strip()
+    if search:
+        query = query.where(
+            User.username.icontains(search, autoescape=True)
+            | User.full_name.icontains(search, autoescape=True)
+            | User.email.icontains(search, autoescape=True)
+        )
+    if request.args.get('role'):
+        query = query.where(User.role == request.args['role'])
+    if request.args.get('faculty'):
+        query = query.where(User.faculty == request.args['faculty'])
+    if request.args.get('course', type=int):
+        query = query.where(User.course == request.args.get('course', type=int))
+    try:
+        users, page = fetch_admin_page(query, User.id, request.args, USER_SORT_COLUMNS, 'name')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    page['users'] = [{
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'role': user.role,
+        'full_name': user.full_name,
+        'faculty': user.faculty,
+        'course': user.course,
+        'created_at': user.created_at.isoformat() if user.created_at else None
+    } for user in users]
+    return jsonify(page)
+
+@app.route('/api/admin/questions')
+def api_admin_questions():
+    """
+    Вопросы с вариантами ответа постранично (варианты - одним selectin-запросом на страницу).
+    Фильтры: q (текст), competency (с учётом алиасов), active (1/0); сортировка sort
+    (order, competency, text, created) и order.
+    """
+    if 'user_id' not in session or session['role'] != 'admin':
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    
+    query = select(Question).options(selectinload(Question.options))
+    search = (request.args.get('q') or '').strip()
+    if search:
+        query = query.where(Question.text.icontains(search, autoescape=True))
+    competency = request.args.get('competency')
+    if competency:
+        keys = [competency] + [alias for alias, target in COMPETENCY_ALIASES.items() if target == competency]
+        query = query.where(Question.competency.in_(keys))
+    if request.args.get('active') in ('0', '1'):
+        query = query.where(Question.active.is_(request.args['active'] == '1'))
+    try:
+        questions, page = fetch_admin_page(query, Question.id, request.args, QUESTION_SORT_COLUMNS, 'order')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    page['questions'] = [serialize_question(question) for question in questions]
+    return jsonify(page)
+
+@app.route('/api/admin/recommendation-rules', methods=['GET', 'PUT', 'DELETE'])
+def api_recommendation_rules():
+    """
+    Правила рекомендаций по компетенциям. PUT {competency, career_fields?, courses?, activities?}
+    заменяет переданные списки, DELETE ?competency= возвращает значения по умолчанию.
+    Уже сохранённые рекомендации не меняются до пересчёта (flask rescore-results).
+    """
+    if 'user_id' not in session or session['role'] != 'admin':
+        return jsonify({'success': False, 'message': 'Доступ запрещён'}), 403
+    
+    if request.method == 'PUT':
+        data = request.json or {}
+        competency = data.get('competency')
+        if competency not in COMPETENCIES:
+            return jsonify({'success': False, 'message': 'Неизвестная компетенция'}), 400
+        changes = {field: data[field] for field in RECOMMENDATION_RULE_FIELDS if field in data}
+        for field, values in changes.items():
+            if not isinstance(values, list) or not all(isinstance(v, str) and v.strip() for v in values):
+                return jsonify({'success': False, 'message': f'{field}: ожидается список непустых строк'}), 400
+        rule = db.session.get(RecommendationRule, competency) or RecommendationRule(competency=competency)
+        for field, values in changes.items():
+            setattr(rule, field, json.dumps([v.strip() for v in values], ensure_ascii=False))
+        db.session.add(rule)
+    elif request.method == 'DELETE':
+        rule = db.session.get(RecommendationRule, request.args.get('competency'))
+        if rule is None:
+            return jsonify({'success': False, 'message': 'Правка не найдена'}), 404
+        db.session.delete(rule)
+    
+    if request.method == 'GET':
+        recommendation_engine.sync(get_counter(RECOMMENDATION_RULES_COUNTER))
+    else:
+        version = bump_counter(RECOMMENDATION_RULES_COUNTER)
+        db.session.commit()
+        recommendation_engine.rebuild(version)
+    
+    rules, _ = recommendation_engine.compiled()
+    overridden = set(db.session.scalars(select(RecommendationRule.competency)))
+    return jsonify({'success': True, 'rules': {
+        comp: {
+            'career_fields': list(rule.career_fields),
+            'courses': list(rule.courses),
+            'activities': list(rule.activities),
+            'overridden': comp in overridden
+        } for comp, rule in rules.items()
+    }})
+
+@app.route('/admin/questions', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def manage_questions():
+    if 'user_id' not in session or session['role'] != 'admin':
+        return jsonify({'success': False, 'message': 'Доступ запрещён'})
+    
+    if request.method == 'POST':
+        data = request.json
+        question = Question(
             text=data['text'],
             competency=data['competency'],
             category=data.get('category'),
@@ -476,27 +1982,15 @@ def manage_questions():
                 order_num=opt.get('order_num')
             )
             db.session.add(option)
+        bank_version = bump_counter(QUESTION_BANK_COUNTER)
         db.session.commit()
+        scoring_index.update_question(question, bank_version)
         
         return jsonify({'success': True, 'question_id': question.id})
     
     elif request.method == 'GET':
-        questions = Question.query.order_by(Question.order_num).all()
-        return jsonify([{
-            'id': q.id,
-            'text': q.text,
-            'competency': q.competency,
-            'resolved_competency': resolve_competency_key(q.competency),
-            'category': q.category,
-            'order_num': q.order_num,
-            'active': q.active,
-            'options': [{
-                'id': o.id,
-                'text': o.text,
-                'score': o.score,
-                'order_num': o.order_num
-            } for o in q.options]
-        } for q in questions])
+        questions = Question.query.options(selectinload(Question.options)).order_by(Question.order_num).all()
+        return jsonify([serialize_question(q) for q in questions])
     
     elif request.method == 'PUT':
         data = request.json
@@ -508,16 +2002,27 @@ def manage_questions():
             question.order_num = data.get('order_num', question.order_num)
             question.active = data.get('active', question.active)
             if 'options' in data:
-                QuestionOption.query.filter_by(question_id=question.id).delete(synchronize_session=False)
+                # Варианты обновляются по позиции, а не пересоздаются: id сохраняются,
+                # и сохранённые ответы остаются пригодными для пересчёта (flask rescore-results)
+                existing = sorted(question.options, key=lambda o: (o.order_num or 0, o.id))
                 for idx, opt in enumerate(data['options'], start=1):
-                    option = QuestionOption(
-                        question_id=question.id,
-                        text=opt['text'],
-                        score=opt['score'],
-                        order_num=opt.get('order_num') or idx
-                    )
-                    db.session.add(option)
+                    if idx <= len(existing):
+                        option = existing[idx - 1]
+                        option.text = opt['text']
+                        option.score = opt['score']
+                        option.order_num = opt.get('order_num') or idx
+                    else:
+                        db.session.add(QuestionOption(
+                            question_id=question.id,
+                            text=opt['text'],
+                            score=opt['score'],
+                            order_num=opt.get('order_num') or idx
+                        ))
+                for option in existing[len(data['options']):]:
+                    db.session.delete(option)
+            bank_version = bump_counter(QUESTION_BANK_COUNTER)
             db.session.commit()
+            scoring_index.update_question(question, bank_version)
             return jsonify({'success': True})
         return jsonify({'success': False, 'message': 'Вопрос не найден'})
     
@@ -525,8 +2030,11 @@ def manage_questions():
         question_id = request.args.get('id')
         question = Question.query.get(question_id)
         if question:
+            question_id = question.id
             db.session.delete(question)
+            bank_version = bump_counter(QUESTION_BANK_COUNTER)
             db.session.commit()
+            scoring_index.remove_question(question_id, bank_version)
             return jsonify({'success': True})
         return jsonify({'success': False, 'message': 'Вопрос не найден'})
 
@@ -535,41 +2043,1589 @@ def api_stats():
     if 'user_id' not in session:
         return jsonify({'error': 'Не авторизован'}), 401
     
-    all_results = TestResult.query.all()
-    stats = calculate_aggregate_stats(all_results)
+    faculty = request.args.get('faculty') or None
+    course = request.args.get('course', type=int)
+    if faculty or course:
+        stats = calculate_aggregate_stats(faculty=faculty, course=course)
+    else:
+        stats = get_aggregate_stats()
     return jsonify(stats)
 
-def calculate_aggregate_stats(results):
-    """Расчёт обезличенной статистики для преподавателей"""
-    if not results:
-        return {}
+# Кодек ответов: заголовок (версия, 3 байта выравнивания) и пары (question_id, option_id) uint32 little-endian
+ANSWERS_CODEC_VERSION = 1
+# Заголовок строки, ответы которой не удалось разобрать: остаются в JSON-колонке answers
+ANSWERS_CODEC_UNREADABLE = 0
+ANSWERS_HEADER = struct.Struct('<B3x')
+ANSWERS_DTYPE = np.dtype('<u4')
+
+def pack_answers(answers):
+    """Ответы [{'question_id', 'option_id'}] в компактный BLOB (8 байт на ответ)."""
+    pairs = np.array([(answer['question_id'], answer['option_id']) for answer in answers], dtype=np.int64).reshape(-1, 2)
+    if pairs.size and (pairs.min() < 0 or pairs.max() > np.iinfo(ANSWERS_DTYPE).max):
+        raise ValueError('Идентификаторы ответов вне диапазона uint32')
+    return ANSWERS_HEADER.pack(ANSWERS_CODEC_VERSION) + pairs.astype(ANSWERS_DTYPE).tobytes()
+
+def unpack_answer_pairs(packed):
+    """
+    Массив (N, 2) пар (question_id, option_id) поверх BLOB без копирования (только для чтения).
+    ValueError для неизвестной версии кодека.
+    """
+    version, = ANSWERS_HEADER.unpack_from(packed)
+    if version != ANSWERS_CODEC_VERSION:
+        raise ValueError(f'Неизвестная версия кодека ответов: {version}')
+    return np.frombuffer(packed, dtype=ANSWERS_DTYPE, offset=ANSWERS_HEADER.size).reshape(-1, 2)
+
+def read_answer_pairs(answers_json, answers_packed):
+    """Пары (question_id, option_id) результата в любом формате хранения."""
+    if answers_packed is not None and answers_packed[:1] != bytes([ANSWERS_CODEC_UNREADABLE]):
+        return unpack_answer_pairs(answers_packed)
+    answers = json.loads(answers_json)
+    return np.array([(answer['question_id'], answer['option_id']) for answer in answers], dtype=np.int64).reshape(-1, 2)
+
+def read_answers(answers_json, answers_packed):
+    """Ответы результата списком {'question_id', 'option_id'}, как их присылает клиент."""
+    if answers_packed is not None and answers_packed[:1] != bytes([ANSWERS_CODEC_UNREADABLE]):
+        return [{'question_id': q, 'option_id': o} for q, o in unpack_answer_pairs(answers_packed).tolist()]
+    return json.loads(answers_json)
+
+# Разобранные рекомендации в памяти процесса: по ключу содержимое не меняется, сбрасывать кэш не нужно
+RECOMMENDATIONS_CACHE_SIZE = 1024
+
+def encode_recommendations(template):
+    """JSON рекомендаций без баллов и его SHA-256 - ключ RecommendationPayload."""
+    payload = json.dumps(template, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest(), payload
+
+def attach_recommendation_scores(template, scores):
+    """
+    Рекомендации для показа: в записи сильных сторон и зон развития шаблона
+    подставляются баллы результата. Шаблон не изменяется.
+    """
+    def scored(entry):
+        if 'competency' not in entry:
+            return dict(entry)
+        return {'name': entry['name'], 'score': scores.get(entry['competency'], 0), 'description': entry['description']}
     
-    all_scores = {comp: [] for comp in COMPETENCIES.keys()}
+    return {
+        'strong_competencies': [scored(entry) for entry in template['strong_competencies']],
+        'development_areas': [scored(entry) for entry in template['development_areas']],
+        'career_paths': list(template['career_paths']),
+        'courses': list(template['courses']),
+        'activities': list(template['activities'])
+    }
+
+# Название компетенции -> ключ, для переноса старых рекомендаций, где записи хранят только название
+COMPETENCY_KEYS_BY_NAME = {info['name']: comp for comp, info in COMPETENCIES.items()}
+
+def recommendations_to_template(recommendations, scores):
+    """
+    Шаблон без баллов из полных рекомендаций старого результата или None, если из шаблона
+    с баллами scores они не восстанавливаются в точности (устаревшее название компетенции,
+    балл не совпадает с баллами результата).
+    """
+    def unscored(entry):
+        comp = COMPETENCY_KEYS_BY_NAME.get(entry.get('name'))
+        if comp is None or entry.get('score') != scores.get(comp):
+            raise ValueError(entry.get('name'))
+        return {'competency': comp, 'name': entry['name'], 'description': entry.get('description')}
+    
+    try:
+        return {
+            'strong_competencies': [unscored(entry) for entry in recommendations['strong_competencies']],
+            'development_areas': [unscored(entry) for entry in recommendations['development_areas']],
+            'career_paths': recommendations['career_paths'],
+            'courses': recommendations['courses'],
+            'activities': recommendations['activities']
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def intern_recommendations(payloads):
+    """
+    Сохраняет рекомендации {hash: JSON}, которых ещё нет в RecommendationPayload.
+    Commit делает вызывающий код.
+    """
+    if not payloads:
+        return
+    existing = set(db.session.scalars(
+        select(RecommendationPayload.hash).where(RecommendationPayload.hash.in_(list(payloads)))
+    ))
+    missing = [{'hash': key, 'payload': payload} for key, payload in payloads.items() if key not in existing]
+    if missing:
+        db.session.execute(insert(RecommendationPayload), missing)
+
+@lru_cache(maxsize=RECOMMENDATIONS_CACHE_SIZE)
+def load_recommendations(recommendation_hash):
+    """
+    Шаблон рекомендаций (без баллов) по ключу содержимого. Объект общий для всех вызовов - изменять его нельзя.
+    KeyError, если ключа нет в RecommendationPayload.
+    """
+    payload = db.session.scalar(
+        select(RecommendationPayload.payload).where(RecommendationPayload.hash == recommendation_hash)
+    )
+    if payload is None:
+        raise KeyError(recommendation_hash)
+    return json.loads(payload)
+
+def read_recommendations(recommendations_json, recommendation_hash, scores):
+    """Рекомендации результата в любом формате хранения; scores - баллы результата (read_result_scores)."""
+    if recommendation_hash is not None:
+        return attach_recommendation_scores(load_recommendations(recommendation_hash), scores)
+    return json.loads(recommendations_json)
+
+ScoredSubmission = namedtuple('ScoredSubmission', ['row', 'scores', 'recommendations', 'recommendations_json'])
+
+def score_submission(user_id, answers, taken_at=None):
+    """
+    Оценивает ответы в памяти и готовит строку TestResult к вставке.
+    ValueError, если ответы не соответствуют банку вопросов.
+    """
+    scores = calculate_competency_profile(answers)
+    recommendations = generate_recommendations(scores)
+    recommendation_hash, recommendations_json = recommendation_engine.encoded(scores)
+    row = {
+        'user_id': user_id,
+        'test_date': taken_at or datetime.utcnow(),
+        'answers': None,
+        'answers_packed': pack_answers(answers),
+        'scores': json.dumps(scores, ensure_ascii=False),
+        'recommendations': None,
+        'recommendation_hash': recommendation_hash,
+        'profile_data': json.dumps({'scores': scores, 'timestamp': (taken_at or datetime.now()).isoformat()}, ensure_ascii=False),
+        'scores_version': SCORES_SCHEMA_VERSION
+    }
+    return ScoredSubmission(row, scores, recommendations, recommendations_json)
+
+def insert_test_results(submissions):
+    """
+    Вставляет оценённые результаты пакетно (executemany) вместе со строками CompetencyScore
+    и обновляет накопительную статистику. Возвращает id в порядке submissions.
+    Commit делает вызывающий код.
+    """
+    # TestResult вставляется первым: транзакция SQLite получает блокировку записи
+    # до чтения агрегатов, поэтому параллельные отправки не потеряют обновления статистики
+    result_ids = db.session.execute(
+        insert(TestResult).returning(TestResult.id, sort_by_parameter_order=True),
+        [submission.row for submission in submissions]
+    ).scalars().all()
+    intern_recommendations({
+        submission.row['recommendation_hash']: submission.recommendations_json for submission in submissions
+    })
     
-    for result in results:
+    score_rows = []
+    for result_id, submission in zip(result_ids, submissions):
+        merged_scores = normalize_scores(submission.scores)
+        score_rows.extend({
+            'result_id': result_id,
+            'user_id': submission.row['user_id'],
+            'competency': comp,
+            'score': score,
+            'test_date': submission.row['test_date']
+        } for comp, score in merged_scores.items())
+    db.session.execute(insert(CompetencyScore), score_rows)
+    update_competency_aggregates([submission.scores for submission in submissions])
+    update_cohort_histograms(submissions)
+    update_student_trends(result_ids, submissions)
+    bump_counter(RESULTS_COUNTER)
+    return result_ids
+
+def backfill_competency_scores(chunk_size=1000):
+    """
+    Миграция: заполняет CompetencyScore для результатов, у которых строк ещё нет.
+    Идёт порциями по возрастанию id с commit после каждой, поэтому её можно прервать и запустить снова.
+    Возвращает число обработанных результатов.
+    """
+    processed = 0
+    last_id = 0
+    while True:
+        chunk = db.session.query(
+            TestResult.id, TestResult.user_id, TestResult.test_date, TestResult.scores, TestResult.scores_version
+        ).filter(
+            TestResult.id > last_id,
+            ~db.session.query(CompetencyScore.id).filter(CompetencyScore.result_id == TestResult.id).exists()
+        ).order_by(TestResult.id).limit(chunk_size).all()
+        if not chunk:
+            return processed
+        rows = []
+        for result_id, user_id, test_date, raw_scores, scores_version in chunk:
+            try:
+                merged_scores = read_result_scores(raw_scores, scores_version)
+            except (TypeError, ValueError):
+                continue
+            rows.extend({
+                'result_id': result_id,
+                'user_id': user_id,
+                'competency': comp,
+                'score': score,
+                'test_date': test_date
+            } for comp, score in merged_scores.items())
+        if rows:
+            db.session.execute(insert(CompetencyScore), rows)
+        db.session.commit()
+        processed += len(chunk)
+        last_id = chunk[-1][0]
+
+# Колонки, добавленные в существующие таблицы после их создания
+ADDED_COLUMNS = {
+    'test_result': [('scores_version', 'INTEGER'), ('answers_packed', 'BLOB'),
+                    ('recommendation_hash', 'VARCHAR(64) REFERENCES recommendation_payload (hash)')]
+}
+
+def upgrade_schema():
+    """
+    Добавляет колонки и индексы, появившиеся в моделях после создания таблиц
+    (create_all создаёт только новые таблицы вместе с их индексами).
+    """
+    inspector = inspect(db.engine)
+    for table, added in ADDED_COLUMNS.items():
+        columns = {column['name'] for column in inspector.get_columns(table)}
+        missing = [(name, ddl) for name, ddl in added if name not in columns]
+        if missing:
+            with db.engine.begin() as connection:
+                for name, ddl in missing:
+                    connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+# Результат, баллы которого не удалось прочитать: миграция его больше не выбирает
+SCORES_VERSION_UNREADABLE = 0
+
+def migrate_legacy_scores_chunk(after_id=0, chunk_size=1000):
+    """
+    Приводит к текущей модели порцию результатов без scores_version (id > after_id, по возрастанию):
+    баллы и profile_data переписываются без алиасов компетенций, строке ставится SCORES_SCHEMA_VERSION.
+    CompetencyScore, статистика и рекомендации уже посчитаны по слитым баллам и не меняются.
+    Строка обновляется, только если её не привёл параллельный пересчёт.
+    Возвращает (размер порции, последний id).
+    """
+    chunk = db.session.execute(
+        select(TestResult.id, TestResult.scores, TestResult.profile_data)
+        .where(TestResult.scores_version.is_(None), TestResult.id > after_id)
+        .order_by(TestResult.id).limit(chunk_size)
+    ).all()
+    if not chunk:
+        return 0, after_id
+    rows = []
+    for result_id, raw_scores, raw_profile in chunk:
         try:
-            scores = json.loads(result.scores)
-            merged_scores = merge_scores_to_current_model(scores)
-            for comp, score in merged_scores.items():
-                if comp in all_scores and score is not None:
-                    all_scores[comp].append(score)
-        except:
+            scores = merge_scores_to_current_model(json.loads(raw_scores))
+            profile_data = json.loads(raw_profile) if raw_profile else {}
+        except (TypeError, ValueError):
+            rows.append({'_id': result_id, '_scores': raw_scores, '_profile': raw_profile,
+                         '_version': SCORES_VERSION_UNREADABLE})
             continue
+        profile_data['scores'] = scores
+        rows.append({
+            '_id': result_id,
+            '_scores': json.dumps(scores, ensure_ascii=False),
+            '_profile': json.dumps(profile_data, ensure_ascii=False),
+            '_version': SCORES_SCHEMA_VERSION
+        })
+    table = TestResult.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id == bindparam('_id'), table.c.scores_version.is_(None))
+        .values(scores=bindparam('_scores'), profile_data=bindparam('_profile'), scores_version=bindparam('_version')),
+        rows
+    )
+    db.session.commit()
+    return len(chunk), chunk[-1][0]
+
+def pack_answers_chunk(after_id=0, chunk_size=1000):
+    """
+    Переносит ответы порции старых результатов (id > after_id) из JSON в answers_packed
+    и очищает JSON-колонку; неразборчивые ответы остаются в JSON с заголовком ANSWERS_CODEC_UNREADABLE.
+    Возвращает (размер порции, последний id).
+    """
+    chunk = db.session.execute(
+        select(TestResult.id, TestResult.answers)
+        .where(TestResult.id > after_id, TestResult.answers_packed.is_(None))
+        .order_by(TestResult.id).limit(chunk_size)
+    ).all()
+    if not chunk:
+        return 0, after_id
+    rows = []
+    for result_id, raw_answers in chunk:
+        try:
+            rows.append({'_id': result_id, '_answers': None, '_packed': pack_answers(json.loads(raw_answers))})
+        except (TypeError, ValueError, KeyError):
+            rows.append({'_id': result_id, '_answers': raw_answers,
+                         '_packed': ANSWERS_HEADER.pack(ANSWERS_CODEC_UNREADABLE)})
+    table = TestResult.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id == bindparam('_id'), table.c.answers_packed.is_(None))
+        .values(answers=bindparam('_answers'), answers_packed=bindparam('_packed')),
+        rows
+    )
+    db.session.commit()
+    return len(chunk), chunk[-1][0]
+
+def intern_recommendations_chunk(after_id=0, chunk_size=1000):
+    """
+    Переводит рекомендации порции результатов (id > after_id) в шаблоны без баллов
+    (RecommendationPayload): старые JSON-рекомендации и payload, сохранённые вместе с баллами.
+    Одинаковые шаблоны сохраняются один раз, JSON-колонка очищается. Рекомендации, которые
+    не восстанавливаются из шаблона в точности, остаются как есть. После последней порции
+    удаляются payload, на которые не ссылается ни один результат.
+    Возвращает (размер порции, последний id).
+    """
+    chunk = db.session.execute(
+        select(TestResult.id, TestResult.recommendations, TestResult.recommendation_hash,
+               TestResult.scores, TestResult.scores_version)
+        .where(TestResult.id > after_id)
+        .order_by(TestResult.id).limit(chunk_size)
+    ).all()
+    if not chunk:
+        referenced = select(TestResult.recommendation_hash).where(TestResult.recommendation_hash.is_not(None))
+        db.session.execute(delete(RecommendationPayload).where(RecommendationPayload.hash.not_in(referenced)))
+        db.session.commit()
+        return 0, after_id
+    rows = []
+    payloads = {}
+    for result_id, raw_recommendations, current_hash, raw_scores, scores_version in chunk:
+        try:
+            if current_hash is None:
+                recommendations = json.loads(raw_recommendations)
+            else:
+                recommendations = load_recommendations(current_hash)
+                entries = recommendations['strong_competencies'] + recommendations['development_areas']
+                if not any('score' in entry for entry in entries):
+                    continue
+            template = recommendations_to_template(recommendations, read_result_scores(raw_scores, scores_version))
+        except (TypeError, ValueError, KeyError):
+            continue
+        if template is None:
+            continue
+        recommendation_hash, payload = encode_recommendations(template)
+        payloads[recommendation_hash] = payload
+        rows.append({'_id': result_id, '_old': current_hash, '_hash': recommendation_hash})
+    if rows:
+        intern_recommendations(payloads)
+        table = TestResult.__table__
+        # Строка обновляется, только если её рекомендации не переписал параллельный пересчёт
+        db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam('_id'), table.c.recommendation_hash.is_(bindparam('_old')))
+            .values(recommendations=None, recommendation_hash=bindparam('_hash')),
+            rows
+        )
+    db.session.commit()
+    return len(chunk), chunk[-1][0]
+
+# Шаги фоновой миграции: функция (after_id) -> (обработано строк, последний id)
+MIGRATION_STEPS = (
+    ('scores', migrate_legacy_scores_chunk),
+    ('answers', pack_answers_chunk),
+    ('recommendation_templates', intern_recommendations_chunk)
+)
+# Аренда фоновой миграции в AppCounter (время окончания в секундах) и пауза между порциями
+MIGRATION_LEASE = 'migration_lease'
+MIGRATION_LEASE_S = 60
+MIGRATION_PAUSE_S = 0.05
+
+class BackgroundMigration:
+    """
+    Фоновая миграция старых результатов порциями: шаги MIGRATION_STEPS выполняются по очереди.
+    Поток запускается в каждом рабочем процессе, но порции обрабатывает один: он продлевает
+    аренду в AppCounter, остальные ждут её истечения. Завершённый шаг отмечается в AppCounter
+    (migration:<шаг>) и больше не проверяется; прерванный продолжается с первой необработанной строки.
+    Между порциями блокировка записи отдаётся отправкам тестов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.migrated = {name: 0 for name, _ in MIGRATION_STEPS}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='background-migration', daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _acquire_lease(held):
+        """Захватывает истёкшую аренду или продлевает свою; возвращает её срок или None."""
+        now = int(time.time())
+        expires = now + MIGRATION_LEASE_S
+        condition = AppCounter.value == held if held else AppCounter.value < now
+        claimed = db.session.execute(
+            update(AppCounter).where(AppCounter.name == MIGRATION_LEASE, condition).values(value=expires)
+        ).rowcount
+        if not claimed and not held and db.session.get(AppCounter, MIGRATION_LEASE) is None:
+            db.session.add(AppCounter(name=MIGRATION_LEASE, value=expires))
+            claimed = 1
+        db.session.commit()
+        return expires if claimed else None
+
+    @staticmethod
+    def pending_steps():
+        done = set(db.session.scalars(
+            select(AppCounter.name).where(AppCounter.name.in_([f'migration:{name}' for name, _ in MIGRATION_STEPS]))
+        ))
+        return [(name, step) for name, step in MIGRATION_STEPS if f'migration:{name}' not in done]
+
+    def _run(self):
+        with app.app_context():
+            held = None
+            positions = {}
+            while True:
+                try:
+                    pending = self.pending_steps()
+                    if not pending:
+                        return
+                    held = self._acquire_lease(held)
+                    if held is None:
+                        db.session.close()
+                        time.sleep(MIGRATION_LEASE_S)
+                        continue
+                    name, step = pending[0]
+                    processed, positions[name] = step(positions.get(name, 0))
+                    if processed:
+                        self.migrated[name] += processed
+                    else:
+                        db.session.add(AppCounter(name=f'migration:{name}', value=1))
+                        db.session.commit()
+                    db.session.close()
+                    time.sleep(MIGRATION_PAUSE_S)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('Ошибка фоновой миграции результатов')
+                    held = None
+                    time.sleep(MIGRATION_LEASE_S)
+
+background_migration = BackgroundMigration()
+
+def calculate_aggregate_stats(faculty=None, course=None):
+    """
+    Расчёт обезличенной статистики для преподавателей запросами к CompetencyScore.
+    Поддерживает срез по факультету и курсу; без среза служит эталоном
+    для проверки накопительной статистики (flask check-stats).
+    """
+    def scoped(query):
+        if faculty or course:
+            query = query.join(User, User.id == CompetencyScore.user_id)
+        if faculty:
+            query = query.filter(User.faculty == faculty)
+        if course:
+            query = query.filter(User.course == course)
+        return query
+    
+    rows = scoped(db.session.query(
+        CompetencyScore.competency,
+        func.count(CompetencyScore.id),
+        func.avg(CompetencyScore.score),
+        func.avg(CompetencyScore.score * CompetencyScore.score),
+        func.min(CompetencyScore.score),
+        func.max(CompetencyScore.score)
+    )).group_by(CompetencyScore.competency).all()
     
     stats = {}
-    for comp, scores_list in all_scores.items():
-        if scores_list:
-            stats[comp] = {
-                'mean': round(np.mean(scores_list), 1),
-                'median': round(np.median(scores_list), 1),
-                'std': round(np.std(scores_list), 1),
-                'min': round(min(scores_list), 1),
-                'max': round(max(scores_list), 1),
-                'count': len(scores_list)
-            }
+    summary = {row[0]: row[1:] for row in rows}
+    for comp in COMPETENCIES.keys():
+        if comp not in summary:
+            continue
+        count, mean, mean_sq, min_score, max_score = summary[comp]
+        # Медиана: одно или два средних значения по индексу (competency, score)
+        middle = scoped(db.session.query(CompetencyScore.score)).filter(
+            CompetencyScore.competency == comp
+        ).order_by(CompetencyScore.score).offset((count - 1) // 2).limit(2 - count % 2).all()
+        median = sum(value for (value,) in middle) / len(middle)
+        stats[comp] = {
+            'mean': round(mean, 1),
+            'median': round(median, 1),
+            'std': round(float(np.sqrt(max(mean_sq - mean * mean, 0.0))), 1),
+            'min': round(min_score, 1),
+            'max': round(max_score, 1),
+            'count': count
+        }
+    
+    return stats
+
+# Ширина интервала гистограммы: баллы округляются до 0.1, поэтому медиана точная
+HISTOGRAM_BIN_WIDTH = 0.1
+
+def _histogram_bin(score):
+    return int(round(score / HISTOGRAM_BIN_WIDTH))
+
+def _histogram_percentile(histogram, count, q):
+    """Процентиль q (0-100) по гистограмме с линейной интерполяцией, как в numpy."""
+    position = (count - 1) * q / 100
+    lower_rank, upper_rank = int(np.floor(position)), int(np.ceil(position))
+    lower = upper = None
+    seen = 0
+    for bin_key in sorted(histogram, key=int):
+        seen += histogram[bin_key]
+        if lower is None and seen > lower_rank:
+            lower = int(bin_key) * HISTOGRAM_BIN_WIDTH
+        if seen > upper_rank:
+            upper = int(bin_key) * HISTOGRAM_BIN_WIDTH
+            break
+    return lower + (upper - lower) * (position - lower_rank)
+
+def _apply_score_to_aggregate(aggregate, score, histogram):
+    """Добавляет один балл: алгоритм Уэлфорда для среднего и дисперсии, min/max, гистограмма."""
+    aggregate.count = (aggregate.count or 0) + 1
+    delta = score - (aggregate.mean or 0.0)
+    aggregate.mean = (aggregate.mean or 0.0) + delta / aggregate.count
+    aggregate.m2 = (aggregate.m2 or 0.0) + delta * (score - aggregate.mean)
+    aggregate.min_score = score if aggregate.min_score is None else min(aggregate.min_score, score)
+    aggregate.max_score = score if aggregate.max_score is None else max(aggregate.max_score, score)
+    bin_key = str(_histogram_bin(score))
+    histogram[bin_key] = histogram.get(bin_key, 0) + 1
+
+def update_competency_aggregates(scores_list):
+    """
+    Учитывает баллы новых результатов в накопительной статистике.
+    Вызывается внутри транзакции сохранения результатов, commit делает вызывающий код.
+    """
+    aggregates = {a.competency: a for a in CompetencyAggregate.query.all()}
+    histograms = {}
+    for scores in scores_list:
+        merged_scores = normalize_scores(scores)
+        for comp, score in merged_scores.items():
+            if score is None:
+                continue
+            aggregate = aggregates.get(comp)
+            if aggregate is None:
+                aggregate = aggregates[comp] = CompetencyAggregate(competency=comp, count=0, mean=0.0, m2=0.0)
+                db.session.add(aggregate)
+            if comp not in histograms:
+                histograms[comp] = json.loads(aggregate.histogram) if aggregate.histogram else {}
+            _apply_score_to_aggregate(aggregate, score, histograms[comp])
+    for comp, histogram in histograms.items():
+        aggregates[comp].histogram = json.dumps(histogram)
+
+def rebuild_competency_aggregates(chunk_size=100000):
+    """
+    Пересчитывает накопительную статистику по всей истории (таблица CompetencyScore).
+    Баллы каждой компетенции читаются порциями по индексу (competency, score) и сводятся
+    векторно; порции объединяются по формуле Чана для среднего и дисперсии.
+    Вместе со статистикой пересчитываются распределения когорт.
+    """
+    aggregates = []
+    for comp in COMPETENCIES.keys():
+        aggregate = CompetencyAggregate(competency=comp, count=0, mean=0.0, m2=0.0)
+        histogram = {}
+        result = db.session.execute(
+            select(CompetencyScore.score).where(CompetencyScore.competency == comp).execution_options(yield_per=chunk_size)
+        )
+        for partition in result.scalars().partitions():
+            values = np.asarray(partition, dtype=np.float64)
+            count, mean = len(values), float(values.mean())
+            total = aggregate.count + count
+            delta = mean - aggregate.mean
+            aggregate.m2 += float(((values - mean) ** 2).sum()) + delta * delta * aggregate.count * count / total
+            aggregate.mean += delta * count / total
+            aggregate.count = total
+            aggregate.min_score = min(float(values.min()), aggregate.min_score if aggregate.min_score is not None else np.inf)
+            aggregate.max_score = max(float(values.max()), aggregate.max_score if aggregate.max_score is not None else -np.inf)
+            bins, counts = np.unique(np.rint(values / HISTOGRAM_BIN_WIDTH).astype(np.int64), return_counts=True)
+            for bin_key, bin_count in zip(bins.tolist(), counts.tolist()):
+                histogram[str(bin_key)] = histogram.get(str(bin_key), 0) + bin_count
+        if aggregate.count:
+            aggregate.histogram = json.dumps(histogram)
+            aggregates.append(aggregate)
+    CompetencyAggregate.query.delete()
+    db.session.add_all(aggregates)
+    rebuild_cohort_histograms()
+    db.session.commit()
+
+def get_aggregate_stats():
+    """
+    Обезличенная статистика из накопительной таблицы, без прохода по TestResult.
+    Только читает: пустую таблицу заполняет prepare_app (или flask rebuild-stats).
+    """
+    aggregates = {a.competency: a for a in CompetencyAggregate.query.all()}
+    
+    stats = {}
+    for comp in COMPETENCIES.keys():
+        aggregate = aggregates.get(comp)
+        if aggregate is None or not aggregate.count:
+            continue
+        histogram = json.loads(aggregate.histogram or '{}')
+        stats[comp] = {
+            'mean': round(aggregate.mean, 1),
+            'median': round(_histogram_percentile(histogram, aggregate.count, 50), 1),
+            'std': round(float(np.sqrt(aggregate.m2 / aggregate.count)), 1),
+            'min': round(aggregate.min_score, 1),
+            'max': round(aggregate.max_score, 1),
+            'count': aggregate.count,
+            'p25': round(_histogram_percentile(histogram, aggregate.count, 25), 1),
+            'p75': round(_histogram_percentile(histogram, aggregate.count, 75), 1)
+        }
     
     return stats
 
+def cohort_keys(faculty, course):
+    """Когорты, в которые входит студент: все, факультет, курс, курс факультета."""
+    keys = {'all': 'all'}
+    if faculty:
+        keys['faculty'] = f'faculty:{faculty}'
+    if course:
+        keys['course'] = f'course:{course}'
+    if faculty and course:
+        keys['group'] = f'faculty:{faculty}|course:{course}'
+    return keys
+
+def update_cohort_histograms(submissions):
+    """
+    Учитывает баллы новых результатов в распределениях когорт.
+    Вызывается внутри транзакции сохранения результатов, commit делает вызывающий код.
+    """
+    user_ids = {submission.row['user_id'] for submission in submissions}
+    profiles = {
+        user_id: (faculty, course)
+        for user_id, faculty, course in db.session.execute(
+            select(User.id, User.faculty, User.course).where(User.id.in_(user_ids))
+        )
+    }
+    increments = {}
+    for submission in submissions:
+        faculty, course = profiles.get(submission.row['user_id'], (None, None))
+        for comp, score in normalize_scores(submission.scores).items():
+            if score is None:
+                continue
+            bin_key = _histogram_bin(score)
+            for cohort in cohort_keys(faculty, course).values():
+                increments[(cohort, comp, bin_key)] = increments.get((cohort, comp, bin_key), 0) + 1
+    if not increments:
+        return
+    
+    existing = {
+        (row.cohort, row.competency, row.bin): row
+        for row in CohortHistogram.query.filter(
+            CohortHistogram.cohort.in_({key[0] for key in increments}),
+            CohortHistogram.bin.in_({key[2] for key in increments})
+        )
+    }
+    for (cohort, comp, bin_key), count in increments.items():
+        row = existing.get((cohort, comp, bin_key))
+        if row is None:
+            db.session.add(CohortHistogram(cohort=cohort, competency=comp, bin=bin_key, count=count))
+        else:
+            row.count += count
+
+def rebuild_cohort_histograms():
+    """
+    Пересчитывает распределения когорт по таблице CompetencyScore
+    (факультет и курс берутся из текущего профиля). Commit делает вызывающий код.
+    """
+    counts = {}
+    rows = db.session.execute(
+        select(User.faculty, User.course, CompetencyScore.competency, CompetencyScore.score, func.count())
+        .join(User, User.id == CompetencyScore.user_id)
+        .group_by(User.faculty, User.course, CompetencyScore.competency, CompetencyScore.score)
+    )
+    for faculty, course, comp, score, count in rows:
+        bin_key = _histogram_bin(score)
+        for cohort in cohort_keys(faculty, course).values():
+            counts[(cohort, comp, bin_key)] = counts.get((cohort, comp, bin_key), 0) + count
+    db.session.execute(delete(CohortHistogram))
+    if counts:
+        db.session.execute(insert(CohortHistogram), [
+            {'cohort': cohort, 'competency': comp, 'bin': bin_key, 'count': count}
+            for (cohort, comp, bin_key), count in counts.items()
+        ])
+    bump_counter(RESULTS_COUNTER)
+
+class CohortDistributionIndex:
+    """
+    Кумулятивные гистограммы когорт в памяти процесса: перцентильный ранг балла
+    находится двоичным поиском по интервалам. Когорта перечитывается из CohortHistogram,
+    только если с момента загрузки изменилась версия результатов (RESULTS_COUNTER).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cohorts = {}
+
+    def distribution(self, cohort, version):
+        cached = self._cohorts.get(cohort)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        rows = db.session.execute(
+            select(CohortHistogram.competency, CohortHistogram.bin, CohortHistogram.count)
+            .where(CohortHistogram.cohort == cohort, CohortHistogram.count > 0)
+            .order_by(CohortHistogram.competency, CohortHistogram.bin)
+        ).all()
+        grouped = {}
+        for comp, bin_key, count in rows:
+            grouped.setdefault(comp, ([], []))
+            grouped[comp][0].append(bin_key)
+            grouped[comp][1].append(count)
+        distribution = {
+            comp: (np.array(bins, dtype=np.int64), np.cumsum(np.array(counts, dtype=np.int64)))
+            for comp, (bins, counts) in grouped.items()
+        }
+        with self._lock:
+            self._cohorts[cohort] = (version, distribution)
+        return distribution
+
+    @staticmethod
+    def rank(distribution, comp, score):
+        """Доля когорты ниже балла (совпадающие баллы считаются наполовину), в процентах."""
+        if comp not in distribution or score is None:
+            return None
+        bins, cumulative = distribution[comp]
+        bin_key = _histogram_bin(score)
+        position = int(np.searchsorted(bins, bin_key))
+        below = int(cumulative[position - 1]) if position else 0
+        equal = int(cumulative[position]) - below if position < len(bins) and bins[position] == bin_key else 0
+        return round((below + equal / 2) / int(cumulative[-1]) * 100, 1)
+
+cohort_distribution = CohortDistributionIndex()
+
+def get_percentile_ranks(scores, faculty, course):
+    """
+    Перцентильные ранги баллов в когортах студента:
+    {когорта: {'key', 'size', 'ranks': {компетенция: ранг}}}.
+    """
+    version = get_counter(RESULTS_COUNTER)
+    percentiles = {}
+    for name, cohort in cohort_keys(faculty, course).items():
+        distribution = cohort_distribution.distribution(cohort, version)
+        if not distribution:
+            continue
+        percentiles[name] = {
+            'key': cohort,
+            'size': max(int(cumulative[-1]) for _, cumulative in distribution.values()),
+            'ranks': {comp: CohortDistributionIndex.rank(distribution, comp, score) for comp, score in scores.items()}
+        }
+    return percentiles
+
+# Сколько последних попыток входит в скользящее среднее сводки динамики
+TREND_ROLLING_WINDOW = 3
+
+def _apply_result_to_trend(summary, result_id, test_date, scores):
+    """
+    Добавляет попытку в сводку динамики студента (словарь из StudentTrend.summary).
+    Возвращает (id предыдущей попытки, изменение баллов) или (None, None) для первой попытки.
+    """
+    point = {'result_id': result_id, 'date': test_date.isoformat() if test_date else None, 'scores': scores}
+    previous = summary.get('latest')
+    if previous is None:
+        summary['first'] = point
+        summary['best'] = dict(scores)
+        delta = None
+    else:
+        delta = {comp: round(score - previous['scores'].get(comp, 0), 1) for comp, score in scores.items()}
+        summary['best'] = {comp: max(score, summary['best'].get(comp, score)) for comp, score in scores.items()}
+    recent = (summary.get('recent', []) + [scores])[-TREND_ROLLING_WINDOW:]
+    summary['latest'] = point
+    summary['delta'] = delta
+    summary['recent'] = recent
+    summary['rolling_average'] = {
+        comp: round(sum(attempt.get(comp, 0) for attempt in recent) / len(recent), 1) for comp in scores
+    }
+    return (previous['result_id'], delta) if previous else (None, None)
+
+def update_student_trends(result_ids, submissions):
+    """
+    Добавляет новые результаты в сводки динамики студентов и сохраняет изменения баллов
+    относительно предыдущих попыток. Если результат пройден раньше последней учтённой попытки
+    (пакетная загрузка бланков), сводка этого студента пересчитывается целиком.
+    Вызывается внутри транзакции сохранения результатов, commit делает вызывающий код.
+    """
+    items = sorted(zip(result_ids, submissions), key=lambda item: (item[1].row['test_date'], item[0]))
+    earliest = {}
+    for _, submission in items:
+        earliest.setdefault(submission.row['user_id'], submission.row['test_date'])
+    trends = {
+        trend.user_id: trend
+        for trend in StudentTrend.query.filter(StudentTrend.user_id.in_(earliest))
+    }
+    stale = {
+        user_id for user_id, trend in trends.items()
+        if trend.latest_date is not None and earliest[user_id] < trend.latest_date
+    }
+    
+    summaries = {}
+    delta_rows = []
+    for result_id, submission in items:
+        user_id = submission.row['user_id']
+        if user_id in stale:
+            continue
+        trend = trends.get(user_id)
+        if trend is None:
+            trend = trends[user_id] = StudentTrend(user_id=user_id, attempts=0)
+            db.session.add(trend)
+        if user_id not in summaries:
+            summaries[user_id] = json.loads(trend.summary) if trend.summary else {}
+        test_date = submission.row['test_date']
+        previous_id, delta = _apply_result_to_trend(
+            summaries[user_id], result_id, test_date, normalize_scores(submission.scores)
+        )
+        trend.attempts += 1
+        trend.latest_result_id = result_id
+        trend.latest_date = test_date
+        if delta is not None:
+            delta_rows.append({
+                'result_id': result_id,
+                'user_id': user_id,
+                'previous_result_id': previous_id,
+                'deltas': json.dumps(delta)
+            })
+    for user_id, summary in summaries.items():
+        trends[user_id].summary = json.dumps(summary, ensure_ascii=False)
+    if delta_rows:
+        db.session.execute(insert(ResultDelta), delta_rows)
+    if stale:
+        rebuild_student_trends(stale)
+
+def rebuild_student_trends(user_ids=None, chunk_size=10000):
+    """
+    Пересчитывает сводки динамики и изменения между попытками по таблице CompetencyScore,
+    для всех студентов или только для user_ids. Commit делает вызывающий код.
+    """
+    query = select(
+        CompetencyScore.user_id, CompetencyScore.result_id, CompetencyScore.test_date,
+        CompetencyScore.competency, CompetencyScore.score
+    )
+    if user_ids is not None:
+        query = query.where(CompetencyScore.user_id.in_(user_ids))
+    query = query.order_by(
+        CompetencyScore.user_id, CompetencyScore.test_date, CompetencyScore.result_id
+    ).execution_options(yield_per=chunk_size)
+    
+    trends = {}
+    delta_rows = []
+    for (user_id, result_id, test_date), rows in groupby(db.session.execute(query), key=lambda row: tuple(row[:3])):
+        raw_scores = {row.competency: row.score for row in rows}
+        scores = {comp: raw_scores[comp] for comp in COMPETENCIES.keys() if comp in raw_scores}
+        trend = trends.setdefault(user_id, {'user_id': user_id, 'attempts': 0, 'summary': {}})
+        previous_id, delta = _apply_result_to_trend(trend['summary'], result_id, test_date, scores)
+        trend['attempts'] += 1
+        trend['latest_result_id'] = result_id
+        trend['latest_date'] = test_date
+        if delta is not None:
+            delta_rows.append({
+                'result_id': result_id,
+                'user_id': user_id,
+                'previous_result_id': previous_id,
+                'deltas': json.dumps(delta)
+            })
+    
+    clear_trends, clear_deltas = delete(StudentTrend), delete(ResultDelta)
+    if user_ids is not None:
+        clear_trends = clear_trends.where(StudentTrend.user_id.in_(user_ids))
+        clear_deltas = clear_deltas.where(ResultDelta.user_id.in_(user_ids))
+    db.session.execute(clear_trends)
+    db.session.execute(clear_deltas)
+    trend_rows = [dict(trend, summary=json.dumps(trend['summary'], ensure_ascii=False)) for trend in trends.values()]
+    for start in range(0, len(trend_rows), chunk_size):
+        db.session.execute(insert(StudentTrend), trend_rows[start:start + chunk_size])
+    for start in range(0, len(delta_rows), chunk_size):
+        db.session.execute(insert(ResultDelta), delta_rows[start:start + chunk_size])
+
+@app.route('/api/students/<int:user_id>/trend')
+def api_student_trend(user_id):
+    """
+    Динамика студента по попыткам: первая, последняя и лучшая попытки, скользящее среднее
+    последних TREND_ROLLING_WINDOW попыток и изменение с предыдущей. Читается только сводка StudentTrend.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Не авторизован'}), 401
+    if user_id != session['user_id'] and session['role'] not in ['teacher', 'admin']:
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    
+    trend = db.session.get(StudentTrend, user_id)
+    summary = json.loads(trend.summary) if trend and trend.summary else {}
+    return jsonify({
+        'user_id': user_id,
+        'attempts': trend.attempts if trend else 0,
+        'window': TREND_ROLLING_WINDOW,
+        'first': summary.get('first'),
+        'latest': summary.get('latest'),
+        'best': summary.get('best'),
+        'rolling_average': summary.get('rolling_average'),
+        'delta': summary.get('delta')
+    })
+
+# Измерения куба когорт
+COHORT_CUBE_DIMENSIONS = ('faculty', 'course', 'competency', 'month')
+
+def summarize_weighted_scores(frame, dimensions):
+    """
+    Среднее, медиана, стандартное отклонение и число оценок по измерениям dimensions
+    для кадра с колонками измерений, score и n (сколько раз встретился балл).
+    Медиана точная: ищется по накопленным n внутри группы, отсортированной по баллу.
+    """
+    keys = list(dimensions) or ['_all']
+    if not dimensions:
+        frame = frame.assign(_all=0)
+    frame = frame.groupby(keys + ['score'], dropna=False, sort=True)['n'].sum().reset_index()
+    grouped = frame.groupby(keys, dropna=False, sort=False)
+    total = grouped['n'].transform('sum')
+    position = grouped['n'].cumsum()
+    frame = frame.assign(
+        sx=frame['score'] * frame['n'],
+        sxx=frame['score'] ** 2 * frame['n'],
+        lower=frame['score'].where(position > (total - 1) // 2),
+        upper=frame['score'].where(position > total // 2)
+    )
+    grouped = frame.groupby(keys, dropna=False, sort=True)
+    sums = grouped[['n', 'sx', 'sxx']].sum()
+    mean = sums['sx'] / sums['n']
+    summary = pd.DataFrame({
+        'mean': mean,
+        'median': (grouped['lower'].first() + grouped['upper'].first()) / 2,
+        'std': np.sqrt((sums['sxx'] / sums['n'] - mean ** 2).clip(lower=0)),
+        'count': sums['n']
+    }).reset_index()
+    return summary.drop(columns=['_all']) if not dimensions else summary
+
+class CohortCube:
+    """
+    Аналитический куб когорт: средний балл, медиана, стандартное отклонение и число оценок
+    по факультету, курсу, компетенции и месяцу. Баллы читаются одним SQL-запросом,
+    сгруппированным до точного значения балла, поэтому кадр pandas занимает десятки
+    тысяч строк вместо миллионов, а медианы остаются точными.
+    Кадр кешируется по версии результатов (RESULTS_COUNTER) и перезагружается при первом
+    обращении после её изменения; параллельные запросы ждут одну перезагрузку.
+    """
+
+    SLICE_CACHE_SIZE = 64
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._frame = None
+        self._version = None
+        self._slices = OrderedDict()
+
+    @staticmethod
+    def _load():
+        month = func.substr(CompetencyScore.test_date, 1, 7).label('month')
+        statement = (
+            select(User.faculty, User.course, CompetencyScore.competency, month,
+                   CompetencyScore.score, func.count().label('n'))
+            .join(User, User.id == CompetencyScore.user_id)
+            .group_by(User.faculty, User.course, CompetencyScore.competency, month, CompetencyScore.score)
+        )
+        frame = pd.read_sql_query(statement, db.session.connection())
+        frame['course'] = frame['course'].astype('Int64')
+        return frame
+
+    def _reload(self):
+        with self._load_lock:
+            version = get_counter(RESULTS_COUNTER)
+            if self._frame is not None and self._version == version:
+                return
+            frame = self._load()
+            with self._lock:
+                self._frame, self._version = frame, version
+                self._slices.clear()
+
+    def frame(self):
+        """Кадр и его версия, не старше текущей версии результатов."""
+        version = get_counter(RESULTS_COUNTER)
+        with self._lock:
+            if self._frame is not None and self._version == version:
+                return self._frame, self._version
+        self._reload()
+        with self._lock:
+            return self._frame, self._version
+
+    def query(self, dimensions=COHORT_CUBE_DIMENSIONS, faculty=None, course=None, competency=None,
+              month_from=None, month_to=None):
+        """Срез куба: строки со значениями измерений dimensions и метриками."""
+        frame, version = self.frame()
+        key = (version, tuple(dimensions), faculty, course, competency, month_from, month_to)
+        with self._lock:
+            if key in self._slices:
+                self._slices.move_to_end(key)
+                return version, self._slices[key]
+        
+        mask = np.ones(len(frame), dtype=bool)
+        if faculty:
+            mask &= (frame['faculty'] == faculty).to_numpy()
+        if course:
+            mask &= (frame['course'] == course).fillna(False).to_numpy()
+        if competency:
+            mask &= (frame['competency'] == competency).to_numpy()
+        if month_from:
+            mask &= (frame['month'] >= month_from).to_numpy()
+        if month_to:
+            mask &= (frame['month'] <= month_to).to_numpy()
+        selected = frame[mask]
+        rows = []
+        if len(selected):
+            summary = summarize_weighted_scores(selected, list(dimensions))
+            summary[['mean', 'median', 'std']] = summary[['mean', 'median', 'std']].round(1)
+            summary = summary.astype(object).where(summary.notna(), None)
+            rows = summary.to_dict('records')
+            for row in rows:
+                row['count'] = int(row['count'])
+                if row.get('course') is not None:
+                    row['course'] = int(row['course'])
+        
+        with self._lock:
+            self._slices[key] = rows
+            while len(self._slices) > self.SLICE_CACHE_SIZE:
+                self._slices.popitem(last=False)
+        return version, rows
+
+cohort_cube = CohortCube()
+
+@app.route('/api/teacher/cohorts')
+def api_teacher_cohorts():
+    """
+    Срез куба когорт. Параметры: group_by (через запятую из faculty, course, competency, month;
+    по умолчанию все), фильтры faculty, course, competency, month_from и month_to (ГГГГ-ММ).
+    """
+    if 'user_id' not in session or session['role'] not in ['teacher', 'admin']:
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    
+    group_by = request.args.get('group_by')
+    dimensions = [d for d in group_by.split(',') if d] if group_by is not None else list(COHORT_CUBE_DIMENSIONS)
+    unknown = [d for d in dimensions if d not in COHORT_CUBE_DIMENSIONS]
+    if unknown or len(set(dimensions)) != len(dimensions):
+        return jsonify({'error': f"Недопустимые измерения group_by: {', '.join(unknown) or 'повторы'}"}), 400
+    competency = request.args.get('competency') or None
+    if competency and competency not in COMPETENCIES:
+        return jsonify({'error': 'Неизвестная компетенция'}), 400
+    
+    version, rows = cohort_cube.query(
+        dimensions=dimensions,
+        faculty=request.args.get('faculty') or None,
+        course=request.args.get('course', type=int),
+        competency=competency,
+        month_from=request.args.get('month_from') or None,
+        month_to=request.args.get('month_to') or None
+    )
+    return jsonify({'version': version, 'dimensions': dimensions, 'rows': rows})
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Пересчитать накопительную статистику по истории результатов."""
+    backfill_competency_scores()
+    rebuild_competency_aggregates()
+    print('Накопительная статистика пересчитана')
+
+@app.cli.command('rebuild-trends')
+def rebuild_trends_command():
+    """Пересчитать сводки динамики студентов по истории результатов."""
+    rebuild_student_trends()
+    db.session.commit()
+    print('Сводки динамики пересчитаны')
+
+@app.cli.command('migrate-scores')
+@click.option('--chunk-size', default=1000, show_default=True, help='Результатов в одной порции.')
+def migrate_scores_command(chunk_size):
+    """Привести баллы старых результатов к текущей модели компетенций."""
+    upgrade_schema()
+    migrated, last_id = 0, 0
+    while True:
+        processed, last_id = migrate_legacy_scores_chunk(last_id, chunk_size)
+        if not processed:
+            break
+        migrated += processed
+        print(f'\rПриведено результатов: {migrated}', end='', flush=True)
+    print(f'\rПриведено результатов: {migrated}')
+
+@app.cli.command('pack-answers')
+@click.option('--chunk-size', default=1000, show_default=True, help='Результатов в одной порции.')
+@click.option('--vacuum', is_flag=True, help='Сжать файл базы после переноса (VACUUM).')
+def pack_answers_command(chunk_size, vacuum):
+    """Перенести ответы старых результатов из JSON в компактный формат."""
+    upgrade_schema()
+    packed, last_id = 0, 0
+    while True:
+        processed, last_id = pack_answers_chunk(last_id, chunk_size)
+        if not processed:
+            break
+        packed += processed
+        print(f'\rПеренесено результатов: {packed}', end='', flush=True)
+    print(f'\rПеренесено результатов: {packed}')
+    if vacuum:
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').exec_driver_sql('VACUUM')
+        print('База сжата')
+
+@app.cli.command('intern-recommendations')
+@click.option('--chunk-size', default=1000, show_default=True, help='Результатов в одной порции.')
+@click.option('--vacuum', is_flag=True, help='Сжать файл базы после переноса (VACUUM).')
+def intern_recommendations_command(chunk_size, vacuum):
+    """Перенести рекомендации старых результатов в общую таблицу шаблонов без баллов."""
+    upgrade_schema()
+    interned, last_id = 0, 0
+    while True:
+        processed, last_id = intern_recommendations_chunk(last_id, chunk_size)
+        if not processed:
+            break
+        interned += processed
+        print(f'\rПеренесено результатов: {interned}', end='', flush=True)
+    print(f'\rПеренесено результатов: {interned}')
+    print(f'Различных рекомендаций: {db.session.scalar(select(func.count()).select_from(RecommendationPayload))}')
+    if vacuum:
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').exec_driver_sql('VACUUM')
+        print('База сжата')
+
+@app.cli.command('answers-benchmark')
+@click.option('--sample', default=10000, show_default=True, help='Сколько результатов взять для замера.')
+def answers_benchmark_command(sample):
+    """Сравнить размер и скорость чтения ответов в JSON и в компактном формате."""
+    connection = db.session.connection()
+    page_size = connection.exec_driver_sql('PRAGMA page_size').scalar()
+    page_count = connection.exec_driver_sql('PRAGMA page_count').scalar()
+    free_pages = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+    print(f'Файл базы: {page_size * page_count / 2 ** 20:.1f} МБ, из них свободно {page_size * free_pages / 2 ** 20:.1f} МБ')
+    
+    rows = db.session.execute(
+        select(TestResult.answers, TestResult.answers_packed).order_by(TestResult.id.desc()).limit(sample)
+    ).all()
+    answers = []
+    for raw, packed in rows:
+        try:
+            answers.append(read_answers(raw, packed))
+        except (TypeError, ValueError):
+            # Неразборчивые ответы (ANSWERS_CODEC_UNREADABLE) в замер не входят
+            continue
+    if not answers:
+        print('Нет результатов для замера')
+        return
+    as_json = [json.dumps(item, ensure_ascii=False) for item in answers]
+    as_packed = [pack_answers(item) for item in answers]
+    json_bytes = sum(len(item.encode('utf-8')) for item in as_json)
+    packed_bytes = sum(len(item) for item in as_packed)
+    total = db.session.scalar(select(func.count(TestResult.id)))
+    print(f'Ответы {len(answers)} результатов: JSON {json_bytes / len(answers):.0f} байт на результат, '
+          f'компактно {packed_bytes / len(answers):.0f} байт '
+          f'(на {total} результатов: {json_bytes / len(answers) * total / 2 ** 20:.1f} МБ -> '
+          f'{packed_bytes / len(answers) * total / 2 ** 20:.1f} МБ)')
+    
+    def throughput(decode, payloads):
+        started = time.perf_counter()
+        for payload in payloads:
+            decode(payload)
+        return len(payloads) / (time.perf_counter() - started)
+    
+    json_rate = throughput(lambda payload: read_answer_pairs(payload, None), as_json)
+    packed_rate = throughput(unpack_answer_pairs, as_packed)
+    print(f'Декодирование в массив пар: JSON {json_rate:,.0f} результатов/с, компактно {packed_rate:,.0f} результатов/с '
+          f'(x{packed_rate / json_rate:.1f})')
+
+@app.cli.command('recommendations-benchmark')
+@click.option('--results', default=100000, show_default=True, help='Сколько профилей баллов сгенерировать.')
+@click.option('--seed', type=int, default=0, show_default=True, help='Зерно генератора профилей.')
+def recommendations_benchmark_command(results, seed):
+    """Замерить стоимость формирования рекомендаций при пакетной оценке результатов."""
+    recommendation_engine.sync(get_counter(RECOMMENDATION_RULES_COUNTER))
+    rng = np.random.default_rng(seed)
+    # Баллы с шагом 0.1, как у calculate_competency_profile
+    matrix = rng.integers(0, 1001, size=(results, len(COMPETENCIES))) / 10
+    profiles = [dict(zip(COMPETENCIES, row)) for row in matrix.tolist()]
+    
+    def per_call_us(memoize):
+        recommendation_engine.rebuild(recommendation_engine.version)
+        started = time.perf_counter()
+        outputs = [recommendation_engine.recommend(scores, memoize=memoize) for scores in profiles]
+        return (time.perf_counter() - started) / len(profiles) * 1e6, outputs
+    
+    cold_us, cold = per_call_us(memoize=False)
+    memo_us, memoized = per_call_us(memoize=True)
+    _, plans = recommendation_engine.compiled()
+    if cold != memoized:
+        print('Ошибка: запомненные рекомендации отличаются от построенных заново')
+        raise SystemExit(1)
+    print(f'Профилей: {results}, различных сигнатур: {len(plans)}')
+    print(f'Без запоминания: {cold_us:.1f} мкс на результат ({cold_us * results / 1e6:.2f} с на пакет)')
+    print(f'С запоминанием: {memo_us:.1f} мкс на результат ({memo_us * results / 1e6:.2f} с на пакет, x{cold_us / memo_us:.1f})')
+
+@app.cli.command('backfill-scores')
+def backfill_scores_command():
+    """Заполнить таблицу CompetencyScore для существующих результатов."""
+    processed = backfill_competency_scores()
+    print(f'Обработано результатов: {processed}')
+
+@app.cli.command('check-stats')
+def check_stats_command():
+    """Сверить накопительную статистику с полным пересчётом."""
+    expected = calculate_aggregate_stats()
+    actual = get_aggregate_stats()
+    mismatches = []
+    for comp in COMPETENCIES.keys():
+        if (comp in expected) != (comp in actual):
+            mismatches.append(f'{comp}: есть только в одном из расчётов')
+            continue
+        if comp not in expected:
+            continue
+        for metric, value in expected[comp].items():
+            if abs(actual[comp][metric] - value) > 0.1 + 1e-9:
+                mismatches.append(f'{comp}.{metric}: ожидалось {value}, в таблице {actual[comp][metric]}')
+    if mismatches:
+        for line in mismatches:
+            print(line)
+        raise SystemExit(1)
+    print('Накопительная статистика совпадает с полным пересчётом')
+
+@contextmanager
+def capture_statements():
+    """Собирает SQL-запросы движка внутри блока в список пар (текст, параметры)."""
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+    
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+# Строка EXPLAIN QUERY PLAN с чтением таблицы целиком: SCAN без условия поиска,
+# в том числе по порядку чужого индекса (SCAN t USING INDEX ix); покрывающий индекс допустим
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?! AS \w+ USING COVERING INDEX| USING COVERING INDEX)\b')
+# Допустимые полные чтения: (название горячего запроса, таблица)
+FULL_SCAN_ALLOWED = frozenset()
+
+def hot_queries():
+    """Горячие запросы приложения для проверки планов: (название, функция, выполняющая запросы)."""
+    student_id = db.session.scalar(select(User.id).where(User.role == 'student').limit(1)) or 1
+    faculty, course = db.session.execute(
+        select(User.faculty, User.course).where(User.id == student_id)
+    ).first() or ('', 1)
+    return [
+        ('история студента', lambda: TestResult.query.filter_by(user_id=student_id)
+            .order_by(TestResult.test_date.desc()).all()),
+        ('профили студентов', lambda: fetch_student_page()),
+        ('профили студентов по курсу факультета', lambda: fetch_student_page(faculty=faculty, course=course)),
+        ('активные вопросы с вариантами', lambda: load_active_questions()),
+        ('статистика курса факультета', lambda: calculate_aggregate_stats(faculty=faculty, course=course)),
+        ('перцентильные ранги', lambda: get_percentile_ranks(
+            {comp: 50 for comp in COMPETENCIES}, faculty, course)),
+        ('сводка динамики', lambda: db.session.get(StudentTrend, student_id)),
+        ('старые результаты', lambda: db.session.execute(
+            select(TestResult.id).where(TestResult.scores_version.is_(None)).limit(1)).first())
+    ]
+
+def find_full_scans(queries):
+    """Выполняет запросы queries и возвращает [(название, таблица, SQL)] для планов с полным чтением таблицы."""
+    tables = set(db.metadata.tables)
+    problems = []
+    for name, run in queries:
+        # Кеши распределений когорт не должны скрыть запросы
+        cohort_distribution._cohorts.clear()
+        with capture_statements() as statements:
+            run()
+        connection = db.session.connection()
+        for statement, parameters in statements:
+            if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            for row in plan:
+                match = FULL_SCAN_PATTERN.match(row[-1])
+                if match and match.group(1) in tables and (name, match.group(1)) not in FULL_SCAN_ALLOWED:
+                    problems.append((name, match.group(1), statement))
+    db.session.rollback()
+    return problems
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Проверить, что горячие запросы не читают таблицы целиком (EXPLAIN QUERY PLAN)."""
+    upgrade_schema()
+    queries = hot_queries()
+    problems = find_full_scans(queries)
+    for name, table, statement in problems:
+        print(f'{name}: полное чтение таблицы {table}\n    {" ".join(statement.split())}')
+    if problems:
+        raise SystemExit(1)
+    print(f'Планы {len(queries)} горячих запросов используют индексы')
+
+# Размер порции строк, которую курсор выгрузки читает из БД за раз
+EXPORT_YIELD_PER = 1000
+
+@app.route('/api/export/results')
+def export_results():
+    """
+    Потоковая выгрузка результатов в CSV или NDJSON (параметр format).
+    Фильтры: date_from/date_to (ГГГГ-ММ-ДД, включительно), faculty, course.
+    Для преподавателя id, имя и логин выгружаются только у студентов с открытым профилем;
+    student_key - псевдоним студента, постоянный в пределах одной выгрузки (для связи попыток).
+    """
+    if 'user_id' not in session or session['role'] not in ['teacher', 'admin']:
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Поддерживаются форматы csv и ndjson'}), 400
+    try:
+        date_from = request.args.get('date_from')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+        date_to = request.args.get('date_to')
+        date_to = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+    except ValueError:
+        return jsonify({'error': 'Дата должна быть в формате ГГГГ-ММ-ДД'}), 400
+    faculty = request.args.get('faculty') or None
+    course = request.args.get('course', type=int)
+    show_identity_always = session['role'] == 'admin'
+    
+    query = select(
+        TestResult.id, TestResult.test_date, TestResult.scores, TestResult.scores_version, TestResult.user_id,
+        User.username, User.full_name, User.faculty, User.course, User.profile_visibility
+    ).join(User, User.id == TestResult.user_id)
+    if date_from:
+        query = query.where(TestResult.test_date >= date_from)
+    if date_to:
+        query = query.where(TestResult.test_date < date_to)
+    if faculty:
+        query = query.where(User.faculty == faculty)
+    if course:
+        query = query.where(User.course == course)
+    query = query.order_by(TestResult.id).execution_options(yield_per=EXPORT_YIELD_PER)
+    
+    columns = ['result_id', 'test_date', 'student_key', 'user_id', 'username', 'full_name', 'faculty', 'course'] + list(COMPETENCIES.keys())
+    # Ключ псевдонимов новый для каждой выгрузки: по нему нельзя восстановить id или связать выгрузки
+    pseudonym_key = secrets.token_bytes(16)
+    
+    def export_rows():
+        for row in db.session.execute(query):
+            identifiable = show_identity_always or row.profile_visibility
+            try:
+                scores = read_result_scores(row.scores, row.scores_version)
+            except (TypeError, ValueError):
+                continue
+            record = {
+                'result_id': row.id,
+                'test_date': row.test_date.isoformat() if row.test_date else None,
+                'student_key': hashlib.blake2b(str(row.user_id).encode(), key=pseudonym_key, digest_size=8).hexdigest(),
+                'user_id': row.user_id if identifiable else None,
+                'username': row.username if identifiable else None,
+                'full_name': row.full_name if identifiable else None,
+                'faculty': row.faculty,
+                'course': row.course
+            }
+            record.update(scores)
+            yield record
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns)
+        buffer.write('\ufeff')  # BOM, чтобы Excel распознал UTF-8
+        writer.writeheader()
+        for record in export_rows():
+            writer.writerow(record)
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    def generate_ndjson():
+        for record in export_rows():
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+    
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv; charset=utf-8'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson; charset=utf-8'
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=results.{export_format}'}
+    )
+
+def build_rescoring_matrices():
+    """
+    Матрицы текущего банка вопросов для пересчёта:
+    баллы вариантов (O), вариант -> вопрос (O) и one-hot вопрос -> компетенция (Q x C).
+    """
+    competency_keys = list(COMPETENCIES.keys())
+    questions = db.session.query(Question.id, Question.competency).order_by(Question.id).all()
+    question_index = {question_id: i for i, (question_id, _) in enumerate(questions)}
+    question_competency = np.zeros((len(questions), len(competency_keys)))
+    for i, (_, competency) in enumerate(questions):
+        resolved_key = resolve_competency_key(competency)
+        if resolved_key in COMPETENCIES:
+            question_competency[i, competency_keys.index(resolved_key)] = 1.0
+    
+    options = db.session.query(QuestionOption.id, QuestionOption.question_id, QuestionOption.score).order_by(QuestionOption.id).all()
+    option_index = {option_id: i for i, (option_id, _, _) in enumerate(options)}
+    option_question = np.array([question_index[question_id] for _, question_id, _ in options], dtype=np.int64)
+    option_scores = np.array([score for _, _, score in options], dtype=np.float64)
+    return competency_keys, question_index, option_index, option_question, option_scores, question_competency
+
+def rescore_results(dry_run=False, chunk_size=1000, progress=None, max_diffs=None):
+    """
+    Пересчитывает баллы и рекомендации всех результатов по текущему банку вопросов и правилам рекомендаций.
+    Ответы порции переводятся в матрицу выбора (результаты x варианты), баллы по компетенциям
+    получаются одним матричным произведением. Изменившиеся результаты перезаписываются
+    пакетными UPDATE с commit после каждой порции (кроме dry_run).
+    Ответы на удалённые вопросы не учитываются; результат, где вариант не относится к вопросу,
+    пропускается. Возвращает отчёт со списком изменений (не больше max_diffs, если задано).
+    """
+    competency_keys, question_index, option_index, option_question, option_scores, question_competency = build_rescoring_matrices()
+    recommendation_engine.sync(get_counter(RECOMMENDATION_RULES_COUNTER))
+    # вариант -> компетенция, и сразу с весами: баллы и максимальные баллы
+    option_competency = question_competency[option_question]
+    score_weights = option_scores[:, None] * option_competency
+    max_weights = MAX_OPTION_SCORE * option_competency
+    # id вопроса/варианта -> номер строки/столбца матриц (-1 - нет в банке)
+    question_position = np.full(max(question_index, default=0) + 1, -1, dtype=np.int64)
+    question_position[list(question_index)] = list(question_index.values())
+    option_column = np.full(max(option_index, default=0) + 1, -1, dtype=np.int64)
+    option_column[list(option_index)] = list(option_index.values())
+    
+    def lookup(table, keys):
+        found = np.full(len(keys), -1, dtype=np.int64)
+        inside = (keys >= 0) & (keys < len(table))
+        found[inside] = table[keys[inside]]
+        return found
+    
+    total = TestResult.query.count()
+    report = {'total': total, 'processed': 0, 'changed': 0, 'skipped': 0, 'diffs': []}
+    query = db.session.query(
+        TestResult.id, TestResult.user_id, TestResult.test_date, TestResult.answers, TestResult.answers_packed,
+        TestResult.scores, TestResult.profile_data, TestResult.recommendation_hash
+    ).order_by(TestResult.id)
+    
+    # Порции читаются по ключу (id > последнего), чтобы в памяти была только текущая
+    last_id = 0
+    while True:
+        chunk = query.filter(TestResult.id > last_id).limit(chunk_size).all()
+        if not chunk:
+            break
+        last_id = chunk[-1].id
+        selection = np.zeros((len(chunk), len(option_index)))
+        valid = np.ones(len(chunk), dtype=bool)
+        for i, row in enumerate(chunk):
+            try:
+                pairs = read_answer_pairs(row.answers, row.answers_packed).astype(np.int64)
+            except (TypeError, ValueError, KeyError):
+                valid[i] = False
+                continue
+            positions = lookup(question_position, pairs[:, 0])
+            answered = positions >= 0
+            columns = lookup(option_column, pairs[answered, 1])
+            if (columns < 0).any() or (option_question[columns] != positions[answered]).any():
+                valid[i] = False
+                continue
+            np.add.at(selection[i], columns, 1)
+        
+        points = selection @ score_weights
+        max_points = selection @ max_weights
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalized = np.where(max_points > 0, points / max_points * 100, 0.0)
+        
+        updates = []
+        for i, row in enumerate(chunk):
+            if not valid[i]:
+                report['skipped'] += 1
+                continue
+            new_scores = {comp: round(float(normalized[i, j]), 1) if max_points[i, j] > 0 else 0
+                          for j, comp in enumerate(competency_keys)}
+            try:
+                old_scores = json.loads(row.scores) if row.scores else {}
+                profile_data = json.loads(row.profile_data) if row.profile_data else {}
+            except (TypeError, ValueError):
+                # Повреждённые баллы или profile_data (SCORES_VERSION_UNREADABLE) не пересчитываются
+                report['skipped'] += 1
+                continue
+            # Рекомендации могли измениться и при тех же баллах - после правки правил администратором
+            encoded_recommendations = recommendation_engine.encoded(new_scores)
+            if old_scores == new_scores and encoded_recommendations[0] == row.recommendation_hash:
+                continue
+            report['changed'] += 1
+            if max_diffs is None or len(report['diffs']) < max_diffs:
+                report['diffs'].append({'result_id': row.id, 'old': old_scores, 'new': new_scores})
+            profile_data['scores'] = new_scores
+            updates.append({
+                'id': row.id,
+                'user_id': row.user_id,
+                'test_date': row.test_date,
+                'scores': new_scores,
+                'encoded_recommendations': encoded_recommendations,
+                'profile_data': profile_data
+            })
+        
+        if updates and not dry_run:
+            intern_recommendations(dict(u['encoded_recommendations'] for u in updates))
+            db.session.execute(update(TestResult), [{
+                'id': u['id'],
+                'scores': json.dumps(u['scores'], ensure_ascii=False),
+                'recommendations': None,
+                'recommendation_hash': u['encoded_recommendations'][0],
+                'profile_data': json.dumps(u['profile_data'], ensure_ascii=False),
+                'scores_version': SCORES_SCHEMA_VERSION
+            } for u in updates])
+            db.session.execute(delete(CompetencyScore).where(CompetencyScore.result_id.in_([u['id'] for u in updates])))
+            db.session.execute(insert(CompetencyScore), [{
+                'result_id': u['id'],
+                'user_id': u['user_id'],
+                'competency': comp,
+                'score': score,
+                'test_date': u['test_date']
+            } for u in updates for comp, score in u['scores'].items()])
+            db.session.commit()
+        
+        report['processed'] += len(chunk)
+        if progress:
+            progress(report['processed'], total)
+    
+    if report['changed'] and not dry_run:
+        rebuild_competency_aggregates()
+        rebuild_student_trends()
+        db.session.commit()
+    return report
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--credentials', type=click.Path(dir_okay=False),
+              help='CSV для логинов и сгенерированных паролей (по умолчанию <файл>.credentials.csv).')
+@click.option('--processes', type=int, default=None, help='Процессов для хэширования паролей.')
+def import_students_command(path, credentials, processes):
+    """Создать студентов из CSV (username, email, full_name, faculty, course[, password])."""
+    with open(path, encoding='utf-8') as f:
+        try:
+            rows = read_students_csv(f.read())
+        except ValueError as e:
+            print(e)
+            raise SystemExit(1)
+    
+    started = time.perf_counter()
+    report = import_students(rows, processes=processes)
+    print(f"Создано: {len(report['created'])}, отклонено: {len(report['rejected'])}, "
+          f"за {time.perf_counter() - started:.1f} с")
+    for entry in report['rejected']:
+        print(f"  строка {entry['line']} ({entry['username']}): {entry['message']}")
+    
+    credentials = credentials or f'{os.path.splitext(path)[0]}.credentials.csv'
+    with open(credentials, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['username', 'password'])
+        for entry in report['created']:
+            writer.writerow([entry['username'], entry.get('password', '')])
+    print(f'Логины и пароли сохранены в {credentials}')
+
+@app.cli.command('rescore-results')
+@click.option('--dry-run', is_flag=True, help='Только показать изменения, не записывая их.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Результатов в одной порции.')
+@click.option('--show', default=20, show_default=True, help='Сколько изменений вывести.')
+def rescore_results_command(dry_run, chunk_size, show):
+    """Пересчитать баллы и рекомендации результатов по текущему банку вопросов."""
+    def progress(processed, total):
+        print(f'\rОбработано {processed} из {total}', end='', flush=True)
+    
+    report = rescore_results(dry_run=dry_run, chunk_size=chunk_size, progress=progress, max_diffs=show)
+    print()
+    for diff in report['diffs'][:show]:
+        changes = ', '.join(
+            f"{comp}: {diff['old'].get(comp)} -> {score}"
+            for comp, score in diff['new'].items() if diff['old'].get(comp) != score
+        )
+        print(f"Результат {diff['result_id']}: {changes or 'рекомендации'}")
+    action = 'Будет изменено' if dry_run else 'Изменено'
+    print(f"{action} результатов: {report['changed']}, пропущено: {report['skipped']}, всего: {report['total']}")
+
 @app.route('/api/toggle_visibility', methods=['POST'])
 def toggle_visibility():
     if 'user_id' not in session or session['role'] != 'student':
@@ -580,9 +3636,34 @@ def toggle_visibility():
     db.session.commit()
     return jsonify({'success': True, 'visibility': user.profile_visibility})
 
-if __name__ == '__main__':
-    import os
+def prepare_app():
+    """
+    Подготовка приложения перед обслуживанием запросов: создание таблиц и прогрев кешей.
+    В production (wsgi.py) вызывается в мастер-процессе до fork рабочих процессов,
+    поэтому индекс банка вопросов наследуется ими готовым.
+    """
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+        scoring_index.sync(get_question_bank_version())
+        recommendation_engine.sync(get_counter(RECOMMENDATION_RULES_COUNTER))
+        if CompetencyAggregate.query.first() is None and TestResult.query.first() is not None:
+            # Таблицы статистики появились после накопления результатов
+            backfill_competency_scores()
+            rebuild_competency_aggregates()
+        if CohortHistogram.query.first() is None and CompetencyScore.query.first() is not None:
+            # Таблица распределений когорт появилась после накопления результатов
+            rebuild_cohort_histograms()
+            db.session.commit()
+        if StudentTrend.query.first() is None and CompetencyScore.query.first() is not None:
+            # Сводки динамики появились после накопления результатов
+            rebuild_student_trends()
+            db.session.commit()
+        # Соединения SQLite не должны переходить в дочерние процессы
+        db.engine.dispose()
+
+if __name__ == '__main__':
+    prepare_app()
+    background_migration.start()
     debug_mode = os.environ.get('FLASK_ENV') != 'production'
     app.run(debug=debug_mode, host='0.0.0.0', port=5000)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
@@ -14,4 +15,38 @@ class Config:
         SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # Ожидание снятия блокировки SQLite вместо немедленной ошибки "database is locked"
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    
+    # Групповая запись результатов тестов одним потоком-писателем
+    SUBMISSION_GROUP_COMMIT = os.environ.get('SUBMISSION_GROUP_COMMIT', '0') == '1'
+    SUBMISSION_GROUP_MAX_SIZE = int(os.environ.get('SUBMISSION_GROUP_MAX_SIZE', 32))
+    SUBMISSION_GROUP_MAX_WAIT_MS = int(os.environ.get('SUBMISSION_GROUP_MAX_WAIT_MS', 10))
+    SUBMISSION_GROUP_TIMEOUT_S = int(os.environ.get('SUBMISSION_GROUP_TIMEOUT_S', 30))
 
+    
+    # Хэширование паролей: scrypt (по умолчанию), bcrypt или pbkdf2 и их стоимость
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 32768))
+    PASSWORD_BCRYPT_ROUNDS = int(os.environ.get('PASSWORD_BCRYPT_ROUNDS', 12))
+    PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600000))
+    # Пул хэширования в каждом процессе: по умолчанию ядра делятся между процессами gunicorn
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS',
+                                               max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_WORKERS', 1)))))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', PASSWORD_HASH_WORKERS * 16))
+    PASSWORD_HASH_QUEUE_TIMEOUT_S = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT_S', 5))
+    # Процессов для хэширования паролей при массовом импорте студентов
+    PASSWORD_IMPORT_PROCESSES = int(os.environ.get('PASSWORD_IMPORT_PROCESSES', os.cpu_count() or 1))
+    
+    # Бюджеты запроса: при превышении в лог пишется предупреждение (метрики - /admin/metrics)
+    REQUEST_QUERY_BUDGET = int(os.environ.get('REQUEST_QUERY_BUDGET', 50))
+    REQUEST_LATENCY_BUDGET_MS = int(os.environ.get('REQUEST_LATENCY_BUDGET_MS', 1000))
+    
+    # Выборочное профилирование запросов (/admin/profiles): каталог отчётов и его ограничения
+    # (по умолчанию вне рабочего дерева: в /app/data или во временном каталоге)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or (
+        '/app/data/profiles' if os.path.exists('/app/data') else os.path.join(tempfile.gettempdir(), 'competency-profiles')
+    )
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 100))
+    PROFILE_MAX_MB = int(os.environ.get('PROFILE_MAX_MB', 100))
@@ -0,0 +1,33 @@
+"""
+Конфигурация gunicorn: WEB_WORKERS процессов x WEB_THREADS потоков.
+
+Приложение загружается в мастер-процессе (preload_app) вместе с numpy и прогретыми
+кешами, рабочие процессы получают его через fork.
+Плавный перезапуск рабочих процессов: kill -HUP <pid мастера>.
+Обновление кода без простоя: kill -USR2 <pid мастера>, затем kill -TERM старому мастеру.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+preload_app = True
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+# Периодический перезапуск рабочих процессов ограничивает рост памяти
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 500))
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Пул соединений, унаследованный от мастера, не используется повторно:
+    # каждый рабочий процесс открывает свои соединения SQLite (WAL, busy_timeout)
+    from app import app, db, background_migration
+    with app.app_context():
+        db.engine.dispose(close=False)
+    # Миграцию старых результатов выполняет один процесс, удерживающий аренду
+    background_migration.start()
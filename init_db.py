@@ -1,8 +1,24 @@
 """
 Скрипт инициализации базы данных с тестовыми вопросами
+
+Генерация большого синтетического набора данных для профилирования:
+    python init_db.py --students 100000 --results-per-student 5
 """
-from app import app, db, User, Question, QuestionOption
-from werkzeug.security import generate_password_hash
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert, select
+
+from app import (
+    app, db, User, Question, QuestionOption, TestResult, COMPETENCIES,
+    MAX_OPTION_SCORE, resolve_competency_key, recommendation_engine, intern_recommendations,
+    rebuild_competency_aggregates,
+    rebuild_student_trends, password_hasher, upgrade_schema, SCORES_SCHEMA_VERSION,
+    ANSWERS_HEADER, ANSWERS_CODEC_VERSION, ANSWERS_DTYPE
+)
 
 # Тестовые вопросы для каждой компетенции (по 5 вопросов на компетенцию)
 SAMPLE_QUESTIONS = [
@@ -522,6 +538,7 @@ def init_database():
     with app.app_context():
         # Создание таблиц
         db.create_all()
+        upgrade_schema()
         
         # Проверка, есть ли уже вопросы
         if Question.query.count() > 0:
@@ -534,7 +551,7 @@ def init_database():
             admin = User(
                 username='admin',
                 email='admin@dubna.ru',
-                password_hash=generate_password_hash('admin123'),
+                password_hash=password_hasher.hash_password('admin123'),
                 role='admin',
                 full_name='Администратор системы'
             )
@@ -547,7 +564,7 @@ def init_database():
             teacher = User(
                 username='teacher',
                 email='teacher@dubna.ru',
-                password_hash=generate_password_hash('teacher123'),
+                password_hash=password_hasher.hash_password('teacher123'),
                 role='teacher',
                 full_name='Тестовый преподаватель'
             )
@@ -560,7 +577,7 @@ def init_database():
             student = User(
                 username='student',
                 email='student@dubna.ru',
-                password_hash=generate_password_hash('student123'),
+                password_hash=password_hasher.hash_password('student123'),
                 role='student',
                 full_name='ИВАН ПОКРОВСКИЙ',
                 faculty='ИСАУ',
@@ -601,6 +618,142 @@ def init_database():
         print(f"   - Создано {sum(len(q['options']) for q in SAMPLE_QUESTIONS)} вариантов ответов")
         print(f"   - Созданы тестовые пользователи")
 
+SYNTHETIC_FACULTIES = ['ИСАУ', 'ФЕН', 'ЭиУ', 'СГН', 'ИФТИ']
+
+def seed_synthetic_data(students, results_per_student, chunk_size=50000, seed=None):
+    """
+    Массовая генерация синтетических студентов и результатов тестов.
+    Ответы моделируются по скрытому уровню компетенций студента, баллы считаются
+    векторно. Вставка - executemany крупными транзакциями, хеш пароля вычисляется один раз.
+    """
+    rng = np.random.default_rng(seed)
+    with app.app_context():
+        started = time.perf_counter()
+        competency_keys = list(COMPETENCIES.keys())
+        questions = Question.query.filter_by(active=True).order_by(Question.order_num).all()
+        questions = [q for q in questions if q.options and resolve_competency_key(q.competency) in COMPETENCIES]
+        if not questions:
+            print("Нет активных вопросов: сначала выполните init_db.py без параметров")
+            return
+        
+        # Вопрос x уровень (1-4) -> вариант с ближайшим баллом
+        question_ids = np.array([q.id for q in questions])
+        question_competency = np.array([competency_keys.index(resolve_competency_key(q.competency)) for q in questions])
+        option_ids = np.zeros((len(questions), MAX_OPTION_SCORE + 1), dtype=np.int64)
+        option_scores = np.zeros((len(questions), MAX_OPTION_SCORE + 1), dtype=np.int64)
+        for i, question in enumerate(questions):
+            for level in range(1, MAX_OPTION_SCORE + 1):
+                option = min(question.options, key=lambda o: abs(o.score - level))
+                option_ids[i, level], option_scores[i, level] = option.id, option.score
+        answers_header = ANSWERS_HEADER.pack(ANSWERS_CODEC_VERSION)
+        max_points = np.array([
+            (question_competency == c).sum() * MAX_OPTION_SCORE for c in range(len(competency_keys))
+        ], dtype=np.float64)
+        
+        # Пользователи
+        password_hash = password_hasher.hash_password('student123')
+        first_index = User.query.filter(User.username.like('synthetic_%')).count()
+        last_user_id = db.session.query(db.func.max(User.id)).scalar() or 0
+        now = datetime.utcnow()
+        for start in range(0, students, chunk_size):
+            db.session.execute(insert(User), [{
+                'username': f'synthetic_{first_index + i}',
+                'email': f'synthetic_{first_index + i}@dubna.local',
+                'password_hash': password_hash,
+                'role': 'student',
+                'full_name': f'Студент {first_index + i}',
+                'faculty': SYNTHETIC_FACULTIES[(first_index + i) % len(SYNTHETIC_FACULTIES)],
+                'course': (first_index + i) % 4 + 1,
+                'profile_visibility': bool((first_index + i) % 3),
+                'created_at': now
+            } for i in range(start, min(start + chunk_size, students))])
+            db.session.commit()
+        user_ids = np.array(db.session.execute(
+            select(User.id).where(User.id > last_user_id).order_by(User.id)
+        ).scalars().all())
+        print(f"Создано студентов: {len(user_ids)} ({time.perf_counter() - started:.1f} с)")
+        
+        # Результаты: уровень компетенции студента + шум попытки -> уровень ответа на вопрос
+        abilities = rng.normal(2.7, 0.6, size=(len(user_ids), len(competency_keys)))
+        total_results = len(user_ids) * results_per_student
+        result_chunk = max(chunk_size // max(results_per_student, 1), 1)
+        period_seconds = 365 * 24 * 3600
+        connection = db.session.connection()
+        # Синтетический набор можно пересоздать, поэтому запись без fsync
+        connection.exec_driver_sql('PRAGMA synchronous=OFF')
+        next_result_id = (db.session.query(db.func.max(TestResult.id)).scalar() or 0) + 1
+        for start in range(0, len(user_ids), result_chunk):
+            chunk_users = user_ids[start:start + result_chunk]
+            chunk_abilities = np.repeat(abilities[start:start + result_chunk], results_per_student, axis=0)
+            owners = np.repeat(chunk_users, results_per_student)
+            levels = np.clip(np.rint(
+                chunk_abilities[:, question_competency] + rng.normal(0, 0.8, size=(len(owners), len(questions)))
+            ), 1, MAX_OPTION_SCORE).astype(np.int64)
+            points = option_scores[np.arange(len(questions)), levels]
+            # Ответы в формате pack_answers: пары (question_id, option_id) uint32
+            answer_pairs = np.empty((len(owners), len(questions), 2), dtype=ANSWERS_DTYPE)
+            answer_pairs[:, :, 0] = question_ids
+            answer_pairs[:, :, 1] = option_ids[np.arange(len(questions)), levels]
+            competency_points = np.zeros((len(owners), len(competency_keys)))
+            for c in range(len(competency_keys)):
+                competency_points[:, c] = points[:, question_competency == c].sum(axis=1)
+            ratios = np.divide(competency_points, max_points, out=np.zeros_like(competency_points), where=max_points > 0)
+            offsets = np.sort(rng.integers(0, period_seconds, size=len(owners)))
+            
+            # id назначаются явно: вставка идёт одной транзакцией без RETURNING
+            result_rows = []
+            score_rows = []
+            payloads = {}
+            for r in range(len(owners)):
+                result_id = next_result_id + r
+                user_id = int(owners[r])
+                scores = {
+                    comp: round(float(ratios[r, c]) * 100, 1) if max_points[c] > 0 else 0
+                    for c, comp in enumerate(competency_keys)
+                }
+                scores_json = json.dumps(scores, ensure_ascii=False)
+                taken_at = now - timedelta(seconds=int(period_seconds - offsets[r]))
+                test_date = taken_at.strftime('%Y-%m-%d %H:%M:%S.%f')
+                recommendation_hash, payload = recommendation_engine.encoded(scores)
+                payloads[recommendation_hash] = payload
+                result_rows.append((
+                    result_id,
+                    user_id,
+                    test_date,
+                    answers_header + answer_pairs[r].tobytes(),
+                    scores_json,
+                    recommendation_hash,
+                    f'{{"scores": {scores_json}, "timestamp": "{taken_at.isoformat()}"}}',
+                    SCORES_SCHEMA_VERSION
+                ))
+                score_rows.extend((result_id, user_id, comp, score, test_date) for comp, score in scores.items())
+            next_result_id += len(owners)
+            connection.exec_driver_sql(
+                'INSERT INTO test_result (id, user_id, test_date, answers_packed, scores, recommendation_hash, profile_data, scores_version) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', result_rows
+            )
+            connection.exec_driver_sql(
+                'INSERT INTO competency_score (result_id, user_id, competency, score, test_date) VALUES (?, ?, ?, ?, ?)',
+                score_rows
+            )
+            intern_recommendations(payloads)
+            db.session.commit()
+            connection = db.session.connection()
+            print(f"Результатов: {min(start + result_chunk, len(user_ids)) * results_per_student} из {total_results}"
+                  f" ({time.perf_counter() - started:.1f} с)")
+        
+        rebuild_competency_aggregates()
+        rebuild_student_trends()
+        db.session.commit()
+        print(f"✅ Синтетические данные созданы за {time.perf_counter() - started:.1f} с")
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Инициализация базы данных')
+    parser.add_argument('--students', type=int, default=0, help='сгенерировать синтетических студентов')
+    parser.add_argument('--results-per-student', type=int, default=1, help='результатов тестов на студента')
+    parser.add_argument('--seed', type=int, help='зерно генератора для воспроизводимых данных')
+    args = parser.parse_args()
     init_database()
+    if args.students:
+        seed_synthetic_data(args.students, args.results_per_student, seed=args.seed)
 
@@ -0,0 +1,219 @@
+"""
+Нагрузочный тест "день экзамена": синтетические студенты проходят тест,
+преподаватели в это время обновляют дашборд и статистику.
+
+Запуск против приложения в этом же процессе (тестовый клиент Flask, БД из DATABASE_URL):
+    python loadtest.py --students 200 --concurrency 50
+Запуск против работающего сервера:
+    python loadtest.py --url http://localhost:5000 --students 200 --concurrency 50
+
+Отчёт: пропускная способность, p50/p95/p99 по каждому эндпоинту, ошибки и блокировки SQLite.
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class HttpClient:
+    """Клиент к работающему серверу, cookie сессии хранятся отдельно для каждого пользователя."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class FlaskClient:
+    """Клиент к приложению в этом же процессе через тестовый клиент Flask."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, payload=None):
+        response = self.client.open(path, method=method, json=payload)
+        return response.status_code, response.get_data()
+
+
+class LoadTest:
+    def __init__(self, make_client, students, concurrency, teachers, poll_interval):
+        self.make_client = make_client
+        self.students = students
+        self.concurrency = concurrency
+        self.teachers = teachers
+        self.poll_interval = poll_interval
+        self.run_id = uuid.uuid4().hex[:8]
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.locked = 0
+        self._lock = threading.Lock()
+
+    def timed(self, client, endpoint, method, path, payload=None):
+        started = time.perf_counter()
+        try:
+            status, body = client.request(method, path, payload)
+        except Exception:
+            status, body = 0, b''
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if status >= 400 or status == 0:
+                self.errors[endpoint] += 1
+            if b'database is locked' in body:
+                self.locked += 1
+        return status, body
+
+    def register(self, client, username, role):
+        client.request('POST', '/register', {
+            'username': username,
+            'email': f'{username}@loadtest.local',
+            'password': 'loadtest',
+            'role': role,
+            'full_name': f'Нагрузочный {username}',
+            'faculty': 'Нагрузочный тест',
+            'course': random.randint(1, 4)
+        })
+
+    def student_session(self, index):
+        client = self.make_client()
+        username = f'load_{self.run_id}_s{index}'
+        self.register(client, username, 'student')
+        self.timed(client, 'POST /login', 'POST', '/login', {'username': username, 'password': 'loadtest'})
+        self.timed(client, 'GET /test/start', 'GET', '/test/start')
+        status, body = self.timed(client, 'GET /api/questionnaire', 'GET', '/api/questionnaire')
+        if status != 200:
+            return
+        questionnaire = json.loads(body)
+        answers = [{
+            'question_id': question['id'],
+            'option_id': random.choice(question['options'])['id']
+        } for question in questionnaire['questions'] if question['options']]
+        self.timed(client, 'POST /test/submit', 'POST', '/test/submit', {
+            'answers': answers,
+            'bank_version': questionnaire['bank_version']
+        })
+
+    def teacher_session(self, index, stop):
+        client = self.make_client()
+        username = f'load_{self.run_id}_t{index}'
+        self.register(client, username, 'teacher')
+        client.request('POST', '/login', {'username': username, 'password': 'loadtest'})
+        while not stop.is_set():
+            self.timed(client, 'GET /teacher/dashboard', 'GET', '/teacher/dashboard')
+            self.timed(client, 'GET /api/stats', 'GET', '/api/stats')
+            stop.wait(self.poll_interval)
+
+    def run(self):
+        stop = threading.Event()
+        teacher_threads = [
+            threading.Thread(target=self.teacher_session, args=(i, stop), daemon=True)
+            for i in range(self.teachers)
+        ]
+        started = time.perf_counter()
+        for thread in teacher_threads:
+            thread.start()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(self.student_session, range(self.students)))
+        stop.set()
+        for thread in teacher_threads:
+            thread.join()
+        return self.report(time.perf_counter() - started)
+
+    def report(self, duration):
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            ms = np.array(values) * 1000
+            endpoints[endpoint] = {
+                'requests': len(values),
+                'errors': self.errors[endpoint],
+                'rps': round(len(values) / duration, 1),
+                'p50_ms': round(float(np.percentile(ms, 50)), 1),
+                'p95_ms': round(float(np.percentile(ms, 95)), 1),
+                'p99_ms': round(float(np.percentile(ms, 99)), 1),
+                'max_ms': round(float(ms.max()), 1)
+            }
+        submitted = endpoints.get('POST /test/submit', {}).get('requests', 0)
+        return {
+            'students': self.students,
+            'concurrency': self.concurrency,
+            'teachers': self.teachers,
+            'duration_s': round(duration, 2),
+            'submissions_per_s': round(submitted / duration, 1),
+            'total_requests': sum(e['requests'] for e in endpoints.values()),
+            'sqlite_locked_errors': self.locked,
+            'endpoints': endpoints
+        }
+
+
+class LockedErrorCounter(logging.Handler):
+    """Считает ошибки "database is locked" в логе приложения (режим без --url)."""
+
+    def __init__(self, load_test):
+        super().__init__(logging.ERROR)
+        self.load_test = load_test
+
+    def emit(self, record):
+        if record.exc_info and 'database is locked' in str(record.exc_info[1]):
+            with self.load_test._lock:
+                self.load_test.locked += 1
+
+
+def print_report(report):
+    print(f"Студентов: {report['students']}, параллельно: {report['concurrency']}, преподавателей: {report['teachers']}")
+    print(f"Длительность: {report['duration_s']} с, отправок в секунду: {report['submissions_per_s']}, "
+          f"запросов: {report['total_requests']}, блокировок SQLite: {report['sqlite_locked_errors']}")
+    print(f"{'Эндпоинт':<26}{'запросов':>9}{'ошибок':>8}{'RPS':>8}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'max мс':>9}")
+    for endpoint, e in report['endpoints'].items():
+        print(f"{endpoint:<26}{e['requests']:>9}{e['errors']:>8}{e['rps']:>8}"
+              f"{e['p50_ms']:>9}{e['p95_ms']:>9}{e['p99_ms']:>9}{e['max_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест системы оценки компетенций')
+    parser.add_argument('--url', help='адрес работающего сервера; без него - приложение в этом процессе')
+    parser.add_argument('--students', type=int, default=100, help='число синтетических студентов')
+    parser.add_argument('--concurrency', type=int, default=20, help='одновременно проходящих тест')
+    parser.add_argument('--teachers', type=int, default=2, help='преподавателей, обновляющих дашборд')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='пауза между обновлениями дашборда, с')
+    parser.add_argument('--json', dest='json_path', help='сохранить отчёт в JSON для сравнения запусков')
+    args = parser.parse_args()
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+        load_test = LoadTest(make_client, args.students, args.concurrency, args.teachers, args.poll_interval)
+    else:
+        from app import app, prepare_app
+        prepare_app()
+        make_client = lambda: FlaskClient(app)
+        load_test = LoadTest(make_client, args.students, args.concurrency, args.teachers, args.poll_interval)
+        app.logger.addHandler(LockedErrorCounter(load_test))
+
+    report = load_test.run()
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+"""
+Тесты работают с временной базой: DATABASE_URL задаётся до импорта приложения,
+так как Config читает его при импорте.
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix='competency-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ['PROFILE_DIR'] = os.path.join(_tmp, 'profiles')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,32 @@
+"""Планы горячих запросов на синтетической базе не должны читать таблицы целиком."""
+import pytest
+from sqlalchemy import text
+
+from app import app, db, find_full_scans, hot_queries
+from init_db import init_database, seed_synthetic_data
+
+
+@pytest.fixture(scope='module')
+def seeded():
+    init_database()
+    seed_synthetic_data(students=500, results_per_student=3, seed=0)
+    with app.app_context():
+        yield
+
+
+def test_hot_queries_use_indexes(seeded):
+    assert find_full_scans(hot_queries()) == []
+
+
+def test_scan_in_foreign_index_order_is_reported(seeded):
+    # Без индекса (user_id, test_date) история студента читается целиком по индексу даты
+    db.session.execute(text('DROP INDEX ix_test_result_user_date'))
+    db.session.commit()
+    # Кеш подготовленных запросов sqlite3 не перепланирует EXPLAIN после смены схемы
+    db.engine.dispose()
+    try:
+        problems = find_full_scans(hot_queries())
+    finally:
+        db.session.execute(text('CREATE INDEX ix_test_result_user_date ON test_result (user_id, test_date)'))
+        db.session.commit()
+    assert ('история студента', 'test_result') in {(name, table) for name, table, _ in problems}
@@ -0,0 +1,7 @@
+"""
+WSGI-точка входа для production-запуска:
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import app, prepare_app
+
+prepare_app()